@@ -0,0 +1,185 @@
+"""
+admission.py
+SLO-driven admission control and load shedding in front of send_message / process_multiple_users.
+Tracks in-flight requests, upstream queue depth and recent p95 latency against a latency SLO,
+and decides per request: admit, defer (wait briefly for capacity), degrade (cheap canned reply
+for low-priority traffic) or reject early with a retry hint.
+"""
+
+import os
+import asyncio
+import time
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional, Any
+from scheduler import PRIORITY_INTERACTIVE
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+LATENCY_SLO = float(os.getenv("LATENCY_SLO_SECONDS", "10"))   # p95 target per request
+MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "256"))
+MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "512"))
+MAX_DEFER_SECONDS = 2.0      # How long interactive work may wait for capacity before rejection
+AT_RISK_RATIO = 0.8          # p95 above this share of the SLO = shed low-priority work
+LATENCY_WINDOW_SECONDS = 30  # Only recent latencies count towards p95
+LATENCY_SAMPLES = 1024
+MIN_LATENCY_SAMPLES = 20     # Fewer recent samples = no p95 signal (one slow turn isn't a trend)
+PRESSURE_RATIO = 0.25        # Latency only sheds while in-flight or queue depth is above this share of its cap
+PROBE_EVERY = 20             # While shedding on latency alone, 1 in N requests goes through so p95 can recover
+MIN_RETRY_AFTER = 1.0
+
+ADMIT = "admit"
+DEFER = "defer"
+DEGRADE = "degrade"
+REJECT = "reject"
+
+class OverloadedError(Exception):
+    """Request rejected by admission control; retry_after is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(f"{message} Please retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+def now() -> float:
+    """Event loop clock (follows virtual time in simulations), monotonic clock outside a loop"""
+    try:
+        return asyncio.get_running_loop().time()
+    except RuntimeError:
+        return time.monotonic()
+
+# ============================================================================
+# SECTION 2: ADMISSION CONTROLLER
+# ============================================================================
+
+class AdmissionController:
+    def __init__(self, slo: float = LATENCY_SLO, max_in_flight: int = MAX_IN_FLIGHT,
+                 max_queue_depth: int = MAX_QUEUE_DEPTH, max_defer: float = MAX_DEFER_SECONDS,
+                 queue_depth_fn: Optional[Callable[[], int]] = None):
+        self.slo = slo
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_defer = max_defer
+        self.queue_depth_fn = queue_depth_fn or (lambda: 0)
+
+        self.in_flight = 0
+        self.decisions = {ADMIT: 0, DEFER: 0, DEGRADE: 0, REJECT: 0}
+        self.probes = 0                 # Requests let through as latency probes
+        self._shed_streak = 0
+        self._latencies: deque = deque(maxlen=LATENCY_SAMPLES)  # (finished_at, seconds)
+        self._p95_cache = (float("-inf"), 0.0)                    # (computed_at, value)
+        self._waiters: deque = deque()  # Futures of deferred requests, woken one per release
+
+    # ---- Signals ----
+
+    def recent_p95(self) -> float:
+        """
+        p95 of latencies finished in the last LATENCY_WINDOW_SECONDS (recomputed at most 4x/s).
+        0.0 when there are fewer than MIN_LATENCY_SAMPLES of them.
+        """
+        current = now()
+        computed_at, value = self._p95_cache
+        if 0 <= current - computed_at < 0.25:
+            return value
+
+        while self._latencies and current - self._latencies[0][0] > LATENCY_WINDOW_SECONDS:
+            self._latencies.popleft()
+        samples = sorted(latency for _, latency in self._latencies)
+        value = samples[math.ceil(0.95 * len(samples)) - 1] if len(samples) >= MIN_LATENCY_SAMPLES else 0.0
+        self._p95_cache = (current, value)
+        return value
+
+    def capacity_exhausted(self) -> bool:
+        return self.in_flight >= self.max_in_flight or self.queue_depth_fn() >= self.max_queue_depth
+
+    def under_pressure(self) -> bool:
+        """Enough work in the system that slow latencies can be caused by load (not an idle box)"""
+        return (self.in_flight >= self.max_in_flight * PRESSURE_RATIO
+                or self.queue_depth_fn() >= self.max_queue_depth * PRESSURE_RATIO)
+
+    def latency_breached(self, threshold: float) -> bool:
+        return self.recent_p95() > threshold and self.under_pressure()
+
+    def overloaded(self) -> bool:
+        return self.capacity_exhausted() or self.latency_breached(self.slo)
+
+    def at_risk(self) -> bool:
+        return self.overloaded() or self.latency_breached(self.slo * AT_RISK_RATIO)
+
+    def _probe(self) -> bool:
+        """Let 1 in PROBE_EVERY requests through while only latency says no, so p95 gets new samples"""
+        if self.capacity_exhausted():
+            return False
+        self._shed_streak += 1
+        if self._shed_streak % PROBE_EVERY:
+            return False
+        self.probes += 1
+        return True
+
+    def retry_after(self) -> float:
+        """Rough time until capacity frees up: one p95 per 'wave' of queued work"""
+        p95 = self.recent_p95() or self.slo
+        waves = 1 + self.queue_depth_fn() / max(1, self.max_in_flight)
+        return max(MIN_RETRY_AFTER, round(p95 * waves, 1))
+
+    # ---- Decisions ----
+
+    async def decide(self, priority: str = PRIORITY_INTERACTIVE) -> str:
+        """ADMIT / DEGRADE / REJECT (DEFER is counted while interactive work waits for capacity)"""
+        if priority != PRIORITY_INTERACTIVE:
+            decision = DEGRADE if self.at_risk() and not self._probe() else ADMIT
+        elif not self.overloaded() or self._probe():
+            decision = ADMIT
+        else:
+            self.decisions[DEFER] += 1
+            decision = ADMIT if await self._wait_for_capacity() else REJECT
+
+        self.decisions[decision] += 1
+        return decision
+
+    async def _wait_for_capacity(self) -> bool:
+        deadline = now() + self.max_defer
+        while self.overloaded():
+            remaining = deadline - now()
+            if remaining <= 0:
+                return False
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=min(remaining, 0.25))
+            except asyncio.TimeoutError:
+                pass  # Re-check: p95 / queue depth can improve without a release
+        return True
+
+    @asynccontextmanager
+    async def track(self):
+        """Count a request as in flight and record its latency"""
+        self.in_flight += 1
+        started = now()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            finished = now()
+            self._latencies.append((finished, finished - started))
+            # Wake the oldest deferred request still waiting (skip timed-out ones)
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+    # ---- Metrics ----
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth_fn(),
+            "p95_latency": round(self.recent_p95(), 3),
+            "slo": self.slo,
+            "at_risk": self.at_risk(),
+            "decisions": dict(self.decisions),
+            "probes": self.probes,
+        }
@@ -8,15 +8,20 @@ import pandas as pd
 # --- CHANGE 1: Import AsyncOpenAI instead of the synchronous client ---
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from log_pipeline import get_logger, flush_logs
+from usage_tracker import UsageTracker
+import runtime
 
 # Load environment variables
 load_dotenv()
 
 # --- CHANGE 2: Instantiate the Asynchronous Client ---
 client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+log = get_logger("asyncaiohttp")  # Queued to a background writer (see log_pipeline.py)
 
 timeline = []
 user_cache = {}
+usage_tracker = UsageTracker()  # Tokens / cached tokens / latency per user (see usage_tracker.py)
 
 # --- The function is now truly non-blocking without using to_thread ---
 async def send_message(user_id, correlation_id, message):
@@ -51,8 +56,9 @@ async def send_message(user_id, correlation_id, message):
         "text": message
     })
 
-    print(f"\n➡️ Sending ({correlation_id}) from {user_id} at {sent_time:.3f}s")
-    print(f"   Payload sent: Model: {payload['model']}, Message: '{message[:30]}...'")
+    fields = {"chat_id": user_id, "correlation_id": correlation_id}
+    log.info(f"\n➡️ Sending ({correlation_id}) from {user_id} at {sent_time:.3f}s", extra=fields)
+    log.debug(f"   Payload sent: Model: {payload['model']}, Message: '{message[:30]}...'", extra=fields)
 
     # ---- CALL ----
     # This is the key change: 'await client.chat.completions.create' 
@@ -62,7 +68,7 @@ async def send_message(user_id, correlation_id, message):
         # Note: Using the chat completions API, which is standard for OpenAI
         response = await client.chat.completions.create(**payload)
     except Exception as e:
-        print(f"Error during OpenAI call for {user_id}: {e}")
+        log.error(f"Error during OpenAI call for {user_id}: {e}", extra=fields)
         return None
 
     received_time = time.time()
@@ -74,6 +80,9 @@ async def send_message(user_id, correlation_id, message):
     # Store the new response ID (Simulating memory context update)
     user_cache[user_id] = response_id
 
+    usage = usage_tracker.record(response, user_id, model=payload["model"],
+                                 latency=received_time - sent_time, correlation_id=correlation_id)
+
     output_preview = output_text[:200]
 
     timeline.append({
@@ -84,13 +93,16 @@ async def send_message(user_id, correlation_id, message):
         "payload": output_preview,
         "response_id": response_id,
         "internal_request_id": None, # OpenAI API often doesn't expose a simple internal ID
-        "text": output_preview
+        "text": output_preview,
+        "input_tokens": usage["input_tokens"],
+        "cached_tokens": usage["cached_tokens"],
+        "output_tokens": usage["output_tokens"]
     })
 
-    print(f"\n🔹 Received response for {correlation_id} | User: {user_id}")
-    print(f"   🔗 Correlation ID (Client): {correlation_id}")
-    print(f"   🔗 OpenAI Response ID:      {response_id}")
-    print(f"   Text: {output_preview}\n")
+    log.info(f"\n🔹 Received response for {correlation_id} | User: {user_id}\n"
+             f"   🔗 Correlation ID (Client): {correlation_id}\n"
+             f"   🔗 OpenAI Response ID:      {response_id}\n"
+             f"   Text: {output_preview}\n", extra={**fields, "response_id": response_id})
 
     return {
         "user_id": user_id,
@@ -162,6 +174,7 @@ async def main():
     sorted_log = sorted(timeline, key=lambda x: x["time"])
     t0 = sorted_log[0]["time"]
 
+    flush_logs()  # Per-request logs first, then the report
     print("\n" + "="*80)
     print(f"🚀 TOTAL EXECUTION TIME: {total_duration:.2f} seconds")
     print("="*80 + "\n")
@@ -180,7 +193,10 @@ async def main():
     df.to_excel("pure_async_debug_log.xlsx", index=False)
     print("\n📁 Saved debug log to: pure_async_debug_log.xlsx")
 
+    usage_tracker.print_report()
+    usage_tracker.export_json("pure_async_usage_log.json")
+    print("📁 Saved usage log to: pure_async_usage_log.json")
+
 if __name__ == "__main__":
-    # Note: On Python 3.11+, you can use asyncio.run(main()) 
-    # to avoid issues, but using the loop directly is also fine.
-    asyncio.run(main())
\ No newline at end of file
+    # runtime.run() = asyncio.run() on uvloop (if installed) with a sized default executor
+    runtime.run(main())
\ No newline at end of file
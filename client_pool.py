@@ -0,0 +1,291 @@
+"""
+client_pool.py
+Pool of OpenAI endpoints (API keys / orgs / base URLs) with their own rate budgets.
+Requests go to the healthy endpoint with the most remaining capacity, endpoints that keep
+failing are taken out by a circuit breaker, and previous_response_id chains stay on the
+endpoint that created them.
+"""
+
+import os
+import asyncio
+import inspect
+import json
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Any
+from openai import OpenAI
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+DEFAULT_REQUESTS_PER_MINUTE = 500
+FAILURE_THRESHOLD = 5        # Consecutive errors before the breaker opens
+BREAKER_COOLDOWN = 30.0      # Seconds an open breaker waits before a probe call
+MAX_CHAIN_AFFINITY = 100_000 # response_id -> endpoint entries remembered (LRU)
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+# Only these mean the endpoint itself is in trouble; 400 / 404 etc. are the request's fault
+BREAKER_STATUS_CODES = {408, 409, 429}  # Plus every 5xx
+
+class EndpointUnavailable(Exception):
+    """Raised when no endpoint (or not the one owning a response chain) can take the call"""
+
+class ChainUnavailable(EndpointUnavailable):
+    """
+    previous_response_id can't be continued: its endpoint is unknown (e.g. evicted from the
+    affinity LRU), unavailable (circuit open) or the response no longer exists.
+    Callers should start a new session instead of failing the turn.
+    """
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Errors that count toward the circuit breaker: 429, 5xx, timeouts, connection errors"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status >= 500 or status in BREAKER_STATUS_CODES
+    try:
+        import openai
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError))
+
+def is_missing_chain(error: Exception) -> bool:
+    """400 / 404 about previous_response_id: the chain expired or lives on another key"""
+    return getattr(error, "status_code", None) in (400, 404) and "previous_response" in str(error)
+
+# ============================================================================
+# SECTION 2: ENDPOINT (RATE BUDGET + CIRCUIT BREAKER)
+# ============================================================================
+
+class Endpoint:
+    """One API key / org / base URL with a token-bucket rate budget and a circuit breaker"""
+
+    def __init__(self, name: str, client: Any, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 failure_threshold: int = FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.client = client
+        self.capacity = float(requests_per_minute)
+        self.refill_rate = requests_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+        self.requests = 0
+        self.failures = 0
+        self.client_errors = 0  # Request errors (4xx): not held against the endpoint
+
+    # ---- Rate budget ----
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def remaining(self, now: Optional[float] = None) -> float:
+        self._refill(now if now is not None else time.monotonic())
+        return self.tokens
+
+    def seconds_until_token(self) -> float:
+        missing = 1.0 - self.remaining()
+        return max(0.0, missing / self.refill_rate) if self.refill_rate else float("inf")
+
+    # ---- Circuit breaker ----
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """Breaker lets a call through (half-open allows a single probe)"""
+        now = now if now is not None else time.monotonic()
+        if self.state == BREAKER_OPEN and now - self.opened_at >= self.cooldown:
+            self.state = BREAKER_HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == BREAKER_HALF_OPEN:
+            return not self.probe_in_flight
+        return self.state == BREAKER_CLOSED
+
+    def on_start(self):
+        self.tokens -= 1
+        self.requests += 1
+        if self.state == BREAKER_HALF_OPEN:
+            self.probe_in_flight = True
+
+    def on_success(self):
+        self.consecutive_failures = 0
+        self.state = BREAKER_CLOSED
+        self.probe_in_flight = False
+
+    def on_client_error(self):
+        """The endpoint answered, the request was bad: a half-open probe still counts as passed"""
+        self.client_errors += 1
+        self.on_success()
+
+    def on_cancel(self):
+        """Call cancelled before an answer (client gone): says nothing about health, let another probe run"""
+        self.probe_in_flight = False
+
+    def on_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == BREAKER_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != BREAKER_OPEN:
+                print(f"⛔ Circuit breaker OPEN for endpoint {self.name} "
+                      f"after {self.consecutive_failures} consecutive errors")
+            self.state = BREAKER_OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "remaining": round(self.remaining(), 2),
+            "requests": self.requests,
+            "failures": self.failures,
+            "client_errors": self.client_errors,
+        }
+
+# ============================================================================
+# SECTION 3: CLIENT POOL
+# ============================================================================
+
+class ClientPool:
+    """Balances Responses API calls over several endpoints"""
+
+    def __init__(self, endpoints: List[Endpoint], max_chain_affinity: int = MAX_CHAIN_AFFINITY):
+        if not endpoints:
+            raise ValueError("ClientPool needs at least one endpoint")
+        self.endpoints = {endpoint.name: endpoint for endpoint in endpoints}
+        self.max_chain_affinity = max_chain_affinity
+        self._chain_owner: "OrderedDict[str, str]" = OrderedDict()  # response_id -> endpoint name
+
+    @classmethod
+    def from_env(cls, client_factory: Callable[..., Any] = OpenAI) -> "ClientPool":
+        """
+        Build the pool from the environment:
+        - OPENAI_POOL_CONFIG: JSON list of {"name", "api_key", "organization", "base_url", "rpm"}
+        - otherwise OPENAI_API_KEYS (comma separated), falling back to OPENAI_API_KEY
+        """
+        raw_config = os.getenv("OPENAI_POOL_CONFIG")
+        if raw_config:
+            configs = json.loads(raw_config)
+        else:
+            keys = os.getenv("OPENAI_API_KEYS") or os.getenv("OPENAI_API_KEY") or ""
+            configs = [{"api_key": key.strip()} for key in keys.split(",") if key.strip()]
+            if not configs:
+                configs = [{"api_key": None}]
+
+        default_rpm = float(os.getenv("OPENAI_POOL_RPM", DEFAULT_REQUESTS_PER_MINUTE))
+        endpoints = []
+        for i, config in enumerate(configs):
+            client_kwargs = {k: config[k] for k in ("api_key", "organization", "base_url") if config.get(k)}
+            endpoints.append(Endpoint(
+                name=config.get("name", f"endpoint{i}"),
+                client=client_factory(**client_kwargs),
+                requests_per_minute=float(config.get("rpm", default_rpm)),
+            ))
+        return cls(endpoints)
+
+    # ---- Routing ----
+
+    def _remember_chain(self, response_id: Optional[str], endpoint: Endpoint):
+        if not response_id:
+            return
+        self._chain_owner[response_id] = endpoint.name
+        self._chain_owner.move_to_end(response_id)
+        while len(self._chain_owner) > self.max_chain_affinity:
+            self._chain_owner.popitem(last=False)
+
+    def owner_of(self, response_id: Optional[str]) -> Optional[str]:
+        """Endpoint name that created response_id (None if unknown)"""
+        return self._chain_owner.get(response_id) if response_id else None
+
+    def resolve_owner(self, response_id: Optional[str], owner: Optional[str] = None) -> Optional[str]:
+        """
+        Endpoint a chained call must go to (None = no chain, any endpoint).
+        owner is the endpoint name saved with the response id (session state); without it the
+        in-memory affinity is used. An unknown owner never falls through to "any endpoint".
+        """
+        if not response_id:
+            return None
+        owner = owner or self.owner_of(response_id)
+        if owner is None and len(self.endpoints) == 1:
+            owner = next(iter(self.endpoints))
+        if owner is None:
+            raise ChainUnavailable(f"Endpoint owning response {response_id} is unknown")
+        if owner not in self.endpoints:
+            raise ChainUnavailable(f"Endpoint {owner} owning response {response_id} is not in the pool")
+        return owner
+
+    async def _pick(self, pinned: Optional[str]) -> Endpoint:
+        """Wait for an endpoint with budget; pinned chains can only use their own endpoint"""
+        while True:
+            now = time.monotonic()
+            if pinned:
+                endpoint = self.endpoints[pinned]
+                if not endpoint.available(now):
+                    raise ChainUnavailable(
+                        f"Endpoint {pinned} owning this response chain is unavailable (circuit open)")
+                candidates = [endpoint]
+            else:
+                candidates = [e for e in self.endpoints.values() if e.available(now)]
+                if not candidates:
+                    raise EndpointUnavailable("All endpoints are unavailable (circuits open)")
+
+            best = max(candidates, key=lambda e: e.remaining(now))
+            if best.remaining(now) >= 1.0:
+                return best
+            await asyncio.sleep(min(e.seconds_until_token() for e in candidates))
+
+    async def _call(self, endpoint: Endpoint, method: Callable[..., Any], payload: Dict) -> Any:
+        endpoint.on_start()
+        try:
+            if inspect.iscoroutinefunction(method):
+                response = await method(**payload)  # AsyncOpenAI: no thread per call
+            else:
+                response = await asyncio.to_thread(method, **payload)
+        except asyncio.CancelledError:
+            endpoint.on_cancel()
+            raise
+        except Exception as error:
+            if is_endpoint_failure(error):
+                endpoint.on_failure()
+            else:
+                endpoint.on_client_error()
+            raise
+        endpoint.on_success()
+        return response
+
+    async def create(self, payload: Dict, owner: Optional[str] = None) -> Any:
+        """
+        Non-blocking client.responses.create() on the best endpoint for this payload.
+        owner: endpoint name stored with previous_response_id (see owner_of()).
+        Raises ChainUnavailable when the chain can't be continued.
+        """
+        previous_response_id = payload.get("previous_response_id")
+        endpoint = await self._pick(self.resolve_owner(previous_response_id, owner))
+        try:
+            response = await self._call(endpoint, endpoint.client.responses.create, payload)
+        except Exception as error:
+            if previous_response_id and is_missing_chain(error):
+                raise ChainUnavailable(f"Response {previous_response_id} not found on {endpoint.name}") from error
+            raise
+        self._remember_chain(getattr(response, "id", None), endpoint)
+        return response
+
+    async def create_embeddings(self, payload: Dict) -> Any:
+        """Non-blocking client.embeddings.create() (no chain affinity needed)"""
+        endpoint = await self._pick(None)
+        return await self._call(endpoint, endpoint.client.embeddings.create, payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoints": {name: endpoint.stats() for name, endpoint in self.endpoints.items()},
+            "tracked_chains": len(self._chain_owner),
+        }
@@ -0,0 +1,224 @@
+"""
+conversation_state.py
+Stateless conversation mode (store=false) as an alternative to previous_response_id chains.
+Each chat's turns are kept locally in a compact list and the context is sent with every call:
+- No server-side state: any key / region can serve the next turn (client_pool fails over freely)
+- Input = stable prefix (system prompt) + trimmed tail of past turns + the new message,
+  so consecutive turns share a long identical prefix the prompt cache can reuse
+- The tail is trimmed in blocks (high / low watermark), so the prefix only shifts on a trim
+- CONVERSATION_MODE=chained (default) | stateless, chosen per deployment
+- Benchmark of both modes through responsesAPIchatbot on the mock backend
+
+Usage:
+    python conversation_state.py bench --chats 50 --turns 24
+"""
+
+import os
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple, Any
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+MODE_CHAINED = "chained"      # previous_response_id, context held by the API (store=true)
+MODE_STATELESS = "stateless"  # store=false, context held here
+MODES = (MODE_CHAINED, MODE_STATELESS)
+
+CONVERSATION_MODE = os.getenv("CONVERSATION_MODE", MODE_CHAINED)
+if CONVERSATION_MODE not in MODES:
+    raise ValueError(f"CONVERSATION_MODE must be one of {MODES}, got {CONVERSATION_MODE!r}")
+
+MAX_TAIL_TOKENS = int(os.getenv("STATELESS_MAX_TAIL_TOKENS", "4000"))  # Trim the tail above this...
+TRIM_TO_RATIO = 0.5            # ...down to this share of it, so trims (prefix shifts) are rare
+MAX_TURN_CHARS = 4000          # Per message cap in the local list
+CHARS_PER_TOKEN = 4            # Rough token estimate, same as mock_backend.py
+TRUNCATION_MARKER = "...[truncated]"
+
+# ============================================================================
+# SECTION 2: COMPACT TURN LIST
+# ============================================================================
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+def compact_text(text: str) -> str:
+    text = (text or "").strip()
+    if len(text) <= MAX_TURN_CHARS:
+        return text
+    return text[:MAX_TURN_CHARS - len(TRUNCATION_MARKER)] + TRUNCATION_MARKER
+
+def compact_turn(user_message: str, ai_response: str) -> Dict[str, Any]:
+    """One user/assistant pair with its token estimate (short keys: stored for every chat)"""
+    user, assistant = compact_text(user_message), compact_text(ai_response)
+    return {"u": user, "a": assistant, "t": estimate_tokens(user) + estimate_tokens(assistant)}
+
+def tail_tokens(turns: List[Dict]) -> int:
+    return sum(turn["t"] for turn in turns)
+
+def append_turn(turns: List[Dict], user_message: str, ai_response: str,
+                max_tail_tokens: int = MAX_TAIL_TOKENS) -> Tuple[List[Dict], int]:
+    """
+    New turn list with this pair appended, and how many old turns were dropped.
+    Over max_tail_tokens, the oldest turns go until the tail fits TRIM_TO_RATIO of the budget;
+    between trims the list only grows at the end, keeping the previous input a prefix of the next.
+    """
+    turns = [*turns, compact_turn(user_message, ai_response)]
+    total = tail_tokens(turns)
+    if total <= max_tail_tokens:
+        return turns, 0
+
+    target = max_tail_tokens * TRIM_TO_RATIO
+    dropped = 0
+    while dropped < len(turns) - 1 and total > target:  # Always keep the newest pair
+        total -= turns[dropped]["t"]
+        dropped += 1
+    return turns[dropped:], dropped
+
+def turns_from_history(chat_history: List[Dict]) -> List[Dict]:
+    """Seed the turn list from a session's raw chatHistory (e.g. after switching from chained mode)"""
+    turns = []
+    pending_user = None
+    for msg in chat_history:
+        if msg.get("role") == "user":
+            pending_user = msg.get("message", "")
+        elif msg.get("role") == "assistant" and pending_user is not None:
+            turns, _ = append_turn(turns, pending_user, msg.get("message", ""))
+            pending_user = None
+    return turns
+
+# ============================================================================
+# SECTION 3: INPUT BUILDING
+# ============================================================================
+
+def message_item(role: str, content: str) -> Dict[str, str]:
+    return {"type": "message", "role": role, "content": content}
+
+def build_input(system_prompt: Optional[str], turns: List[Dict], new_items: List[Dict]) -> List[Dict]:
+    """
+    Responses API input for a stateless call, most stable part first:
+    system prompt, past turns (oldest first), then this turn's items.
+    Anything that varies per call belongs in new_items, not in the system prompt.
+    """
+    items = [message_item("developer", system_prompt)] if system_prompt else []
+    for turn in turns:
+        items.append(message_item("user", turn["u"]))
+        items.append(message_item("assistant", turn["a"]))
+    items.extend(new_items)
+    return items
+
+def stateless_payload(payload: Dict) -> Dict:
+    """Mark a payload as stateless: nothing stored server-side, no chain to follow"""
+    payload.pop("previous_response_id", None)
+    payload["store"] = False
+    return payload
+
+# ============================================================================
+# SECTION 4: BENCHMARK (CHAINED vs STATELESS)
+# ============================================================================
+
+BENCH_QUESTION = "Can you explain the next step in more detail and give one concrete example of it?"
+
+def bench_reply(reply_tokens: int):
+    """Mock reply_fn giving replies of about reply_tokens tokens"""
+    from mock_backend import default_reply
+
+    filler = " ".join(["detail"] * reply_tokens)[:reply_tokens * CHARS_PER_TOKEN]
+
+    def reply(payload: Dict) -> str:
+        return f"{default_reply(payload)[:80]} {filler}"
+    return reply
+
+async def run_mode(engine, mode: str, chats: int, turns: int, latency: float, prefill_latency: float,
+                   reply_tokens: int) -> Dict[str, Any]:
+    from mock_backend import mock_pool
+    from usage_tracker import STAGE_RESET
+
+    engine.CONVERSATION_MODE = mode
+    engine.client_pool = mock_pool(latency=latency, prefill_latency=prefill_latency,
+                                   reply_fn=bench_reply(reply_tokens), asynchronous=True)
+    engine.usage_tracker.reset()
+    latencies: List[float] = []
+
+    async def chat(index: int):
+        chat_id = f"{mode}-{index:04d}"
+        for turn in range(turns):
+            started = time.perf_counter()
+            await engine.send_message({"chatId": chat_id, "sessionID": chat_id,
+                                       "message": f"Turn {turn}: {BENCH_QUESTION}"})
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[chat(i) for i in range(chats)])
+    elapsed = time.perf_counter() - started
+
+    report = engine.usage_tracker.report()
+    totals = report["totals"]
+    requests = len(latencies)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "turns": requests,
+        "calls": totals["requests"],
+        "resets": report["by_stage"].get(STAGE_RESET, {}).get("requests", 0),
+        "seconds": elapsed,
+        "p50": latencies[requests // 2],
+        "p95": latencies[int(requests * 0.95)],
+        "input_per_turn": totals["input_tokens"] / requests,
+        "uncached_per_turn": (totals["input_tokens"] - totals["cached_tokens"]) / requests,
+        "output_per_turn": totals["output_tokens"] / requests,
+        "cache_hit_ratio": totals["cache_hit_ratio"],
+    }
+
+def bench(chats: int, turns: int, latency: float, prefill_latency: float, reply_tokens: int) -> List[Dict]:
+    # No queueing, admission shedding or embeddings: compare the two modes only
+    os.environ.setdefault("MAX_CONCURRENT_UPSTREAM", str(chats))
+    os.environ.setdefault("LONG_TERM_MEMORY", "0")
+    from mock_backend import ensure_placeholder_credentials
+    ensure_placeholder_credentials()  # The engine builds ClientPool.from_env() on import
+    import responsesAPIchatbot as engine
+    from log_pipeline import ROOT_LOGGER, flush_logs
+    from scheduler import FairScheduler
+    from admission import AdmissionController
+    import runtime
+
+    engine.scheduler = FairScheduler(max_concurrent=chats)
+    engine.admission = AdmissionController(max_in_flight=chats, max_queue_depth=chats,
+                                           queue_depth_fn=engine.scheduler.queued_count)
+    engine.LONG_TERM_MEMORY_ENABLED = False
+    logging.getLogger(ROOT_LOGGER).setLevel(logging.WARNING)  # Skip per-request logs
+
+    async def run_all() -> List[Dict]:
+        return [await run_mode(engine, mode, chats, turns, latency, prefill_latency, reply_tokens)
+                for mode in MODES]
+
+    results = runtime.run(run_all(), quiet=True)
+    flush_logs()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Chained (previous_response_id) vs stateless (store=false) turns")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="Latency and tokens of both modes on the mock backend")
+    bench_parser.add_argument("--chats", type=int, default=50)
+    bench_parser.add_argument("--turns", type=int, default=24, help="Turns per chat")
+    bench_parser.add_argument("--latency", type=float, default=0.1, help="Mock base latency (s)")
+    bench_parser.add_argument("--prefill-ms", type=float, default=0.05,
+                              help="Mock prefill time per uncached input token (ms)")
+    bench_parser.add_argument("--reply-tokens", type=int, default=150)
+    args = parser.parse_args()
+
+    print(f"⏱️ {args.chats} chats x {args.turns} turns | {args.latency}s base latency + "
+          f"{args.prefill_ms}ms per uncached input token | ~{args.reply_tokens} token replies | "
+          f"stateless tail {MAX_TAIL_TOKENS} tokens")
+    for r in bench(args.chats, args.turns, args.latency, args.prefill_ms / 1000, args.reply_tokens):
+        print(f"   {r['mode']:<9} | {r['calls']} calls ({r['resets']} resets) for {r['turns']} turns | "
+              f"p50 {r['p50']:.3f}s p95 {r['p95']:.3f}s | in/turn {r['input_per_turn']:.0f} "
+              f"(uncached {r['uncached_per_turn']:.0f}, hit {r['cache_hit_ratio']:.0%}) | "
+              f"out/turn {r['output_per_turn']:.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+log_pipeline.py
+Non-blocking structured logging for the chatbot scripts.
+- Log calls on the event loop only enqueue a record; a background thread formats and writes
+  them in batches, so a slow terminal or pipe no longer stalls every chat
+- Every record carries chat_id / correlation_id (bound per request with log_context)
+- Per-level sampling for hot-path messages; a request is kept or dropped as a whole
+- LOG_MODE=print writes synchronously on the calling thread (the old print behaviour)
+
+Config (env): LOG_LEVEL=DEBUG, LOG_FORMAT=text|json, LOG_MODE=async|print,
+              LOG_SAMPLE="DEBUG=0.05,INFO=1"
+
+Usage:
+    python log_pipeline.py bench --chats 1000 --turns 5 --sink tty
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import random
+import atexit
+import logging
+import argparse
+import threading
+import contextvars
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, TextIO
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")     # text = the message as printed before, json = one object per line
+LOG_MODE = os.getenv("LOG_MODE", "async")        # async = background writer, print = synchronous write
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")         # e.g. "DEBUG=0.05,INFO=0.5" (WARNING and above are never sampled)
+QUEUE_SIZE = 100_000                             # Records buffered before new ones are dropped
+FLUSH_INTERVAL = 0.05                            # Writer thread wake-up period (seconds)
+WRITE_BATCH = 1024                               # Records joined into one write() by the writer thread
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """ "DEBUG=0.05,INFO=1" -> {10: 0.05, 20: 1.0} """
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        level_name, _, rate = part.partition("=")
+        level = logging.getLevelName(level_name.strip().upper())
+        if isinstance(level, int) and level < logging.WARNING:
+            rates[level] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+# ============================================================================
+# SECTION 2: REQUEST CONTEXT
+# ============================================================================
+
+CHAT_ID = contextvars.ContextVar("log_chat_id", default=None)
+CORRELATION_ID = contextvars.ContextVar("log_correlation_id", default=None)
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+def current_correlation_id() -> Optional[str]:
+    return CORRELATION_ID.get()
+
+def current_chat_id() -> Optional[str]:
+    return CHAT_ID.get()
+
+@contextmanager
+def log_context(chat_id: Optional[str] = None, correlation_id: Optional[str] = None):
+    """Bind chat_id / correlation_id to every record logged inside (tasks created inside inherit it)"""
+    tokens = []
+    if chat_id is not None:
+        tokens.append((CHAT_ID, CHAT_ID.set(chat_id)))
+    if correlation_id is not None:
+        tokens.append((CORRELATION_ID, CORRELATION_ID.set(correlation_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+# ============================================================================
+# SECTION 3: FILTER & FORMATTERS
+# ============================================================================
+
+class ContextSamplingFilter(logging.Filter):
+    """Stamps chat_id / correlation_id on the record, then applies the per-level sample rate"""
+
+    def __init__(self, sample_rates: Dict[int, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.chat_id = getattr(record, "chat_id", None) or CHAT_ID.get()
+        record.correlation_id = getattr(record, "correlation_id", None) or CORRELATION_ID.get()
+
+        rate = self.sample_rates.get(record.levelno, 1.0)
+        if rate >= 1.0:
+            return True
+        # Hash the correlation id so a sampled request keeps all of its lines
+        if record.correlation_id:
+            keep = zlib.crc32(record.correlation_id.encode("utf-8")) % 10_000 < rate * 10_000
+        else:
+            keep = random.random() < rate
+        if not keep:
+            self.sampled_out += 1
+        return keep
+
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class TextFormatter(logging.Formatter):
+    """The message exactly as the print() it replaces (emoji and [ChatID: ...] included)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        return message
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, chat_id, correlation_id, msg + any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "chat_id": record.chat_id,
+            "correlation_id": record.correlation_id,
+            "msg": record.getMessage().strip(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# ============================================================================
+# SECTION 4: HANDLERS
+# ============================================================================
+
+class BackgroundWriterHandler(logging.Handler):
+    """
+    emit() only appends the record to a bounded buffer (no lock, no formatting, no I/O on
+    the event loop). A daemon thread wakes every FLUSH_INTERVAL, formats whatever piled up
+    and writes it in one call, so the loop never waits on the terminal or pipe. When the
+    buffer is full new records are dropped (and counted) instead of blocking.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, queue_size: int = QUEUE_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        super().__init__()
+        self.stream = stream  # None = whatever sys.stdout is at write time
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.buffer: deque = deque()  # append / popleft are atomic, no extra lock needed
+        self.dropped = 0
+        self.written = 0
+        self._write_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # Skips logging.Handler's per-record lock: emit() is already thread-safe
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        if len(self.buffer) >= self.queue_size:
+            self.dropped += 1
+        else:
+            self.buffer.append(record)
+
+    def _write_loop(self):
+        while not self._stopping.wait(self.flush_interval):
+            self._drain()
+
+    def _drain(self):
+        with self._write_lock:  # One writer at a time keeps batches in order
+            while self.buffer:
+                lines = []
+                while self.buffer and len(lines) < WRITE_BATCH:
+                    record = self.buffer.popleft()
+                    try:
+                        lines.append(self.format(record))
+                    except Exception:
+                        self.handleError(record)
+                try:
+                    stream = self.stream or sys.stdout
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                    self.written += len(lines)
+                except Exception:
+                    pass  # A broken sink must not kill the writer
+
+    def flush(self):
+        """Write everything buffered so far (on the calling thread)"""
+        self._drain()
+
+    def close(self):
+        self._stopping.set()
+        self.flush()
+        super().close()
+
+class PrintHandler(logging.Handler):
+    """Synchronous write on the calling thread, like the print() calls it replaces"""
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        super().__init__()
+        self.stream = stream
+        self.dropped = 0
+        self.written = 0
+
+    def emit(self, record: logging.LogRecord):
+        print(self.format(record), file=self.stream or sys.stdout)
+        self.written += 1
+
+# ============================================================================
+# SECTION 5: SETUP
+# ============================================================================
+
+ROOT_LOGGER = "chatbot"
+_handler: Optional[logging.Handler] = None
+_filter: Optional[ContextSamplingFilter] = None
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, mode: str = LOG_MODE,
+                  sample: str = LOG_SAMPLE, stream: Optional[TextIO] = None) -> logging.Logger:
+    """(Re)configure the shared "chatbot" logger; get_logger() calls this once with the env config"""
+    global _handler, _filter
+    root = logging.getLogger(ROOT_LOGGER)
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _handler.close()
+
+    _filter = ContextSamplingFilter(parse_sample_rates(sample))
+    _handler = PrintHandler(stream) if mode == "print" else BackgroundWriterHandler(stream)
+    _handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _handler.addFilter(_filter)
+
+    root.addHandler(_handler)
+    root.setLevel(level)
+    root.propagate = False
+    return root
+
+def get_logger(name: str) -> logging.Logger:
+    """Child of the shared pipeline logger, e.g. get_logger("responsesAPIchatbot")"""
+    if _handler is None:
+        setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+def flush_logs():
+    """Wait for the background writer to catch up (call before printing summaries)"""
+    if _handler is not None:
+        _handler.flush()
+
+def log_stats() -> Dict[str, Any]:
+    return {
+        "mode": "print" if isinstance(_handler, PrintHandler) else "async",
+        "written": getattr(_handler, "written", 0),
+        "dropped": getattr(_handler, "dropped", 0),
+        "sampled_out": _filter.sampled_out if _filter else 0,
+        "queued": len(_handler.buffer) if isinstance(_handler, BackgroundWriterHandler) else 0,
+    }
+
+atexit.register(flush_logs)
+
+# ============================================================================
+# SECTION 6: BENCHMARK (PRINT vs PIPELINE)
+# ============================================================================
+
+def bench_child(chats: int, turns: int):
+    """
+    Runs inside a fresh process (LOG_MODE etc. come from its env, stdout is the sink):
+    `chats` concurrent chats x `turns` turns through responsesAPIchatbot on a zero-latency mock,
+    so logging is the main per-request cost. Result goes to stderr as JSON.
+    """
+    import asyncio
+    import log_pipeline  # The instance the engine logs through (this file runs as __main__)
+    import responsesAPIchatbot as engine
+    from mock_backend import mock_pool
+
+    engine.client_pool = mock_pool(latency=0.0)
+
+    async def chat(chat_id: str):
+        for turn in range(turns):
+            await engine.send_message({"chatId": chat_id, "sessionID": f"bench-{chat_id}",
+                                       "message": f"Message {turn} from {chat_id}"})
+
+    async def run() -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*[chat(f"c{i:05d}") for i in range(chats)])
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    drain_started = time.perf_counter()
+    log_pipeline.flush_logs()
+    drain = time.perf_counter() - drain_started
+    print(json.dumps({"requests": chats * turns, "seconds": elapsed, "drain_seconds": drain,
+                      **log_pipeline.log_stats()}), file=sys.stderr)
+
+TTY_BYTES_PER_SECOND = 2_000_000  # Rough terminal emulator throughput for the "tty" sink
+
+def run_bench_mode(mode: str, sink: str, chats: int, turns: int, sample: str) -> Dict[str, Any]:
+    from mock_backend import ensure_placeholder_credentials
+
+    ensure_placeholder_credentials()  # The child's engine builds ClientPool.from_env() on import
+    env = {**os.environ, "LOG_MODE": mode, "LOG_SAMPLE": sample, "LONG_TERM_MEMORY": "0",
+           "ADMISSION_MAX_IN_FLIGHT": str(chats), "ADMISSION_MAX_QUEUE_DEPTH": str(10 * chats)}
+    command = [sys.executable, os.path.abspath(__file__), "_child", "--chats", str(chats), "--turns", str(turns)]
+
+    if sink in ("pipe", "tty"):
+        # A separate reader process on the other end of stdout, like a log shipper; "tty"
+        # reads at TTY_BYTES_PER_SECOND with unbuffered stdout, like a terminal emulator
+        reader_code = "import sys\nfor _ in sys.stdin: pass"
+        if sink == "tty":
+            env["PYTHONUNBUFFERED"] = "1"
+            reader_code = ("import sys, time\nwhile sys.stdin.buffer.read1(4096):\n"
+                           f"    time.sleep(4096 / {TTY_BYTES_PER_SECOND})")
+        reader = subprocess.Popen([sys.executable, "-c", reader_code], stdin=subprocess.PIPE)
+        child = subprocess.run(command, env=env, stdout=reader.stdin, stderr=subprocess.PIPE, text=True)
+        reader.stdin.close()
+        reader.wait()
+    else:
+        with open(os.devnull if sink == "devnull" else sink, "w") as out:
+            child = subprocess.run(command, env=env, stdout=out, stderr=subprocess.PIPE, text=True)
+
+    if child.returncode != 0:
+        raise RuntimeError(child.stderr)
+    return json.loads(child.stderr.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Structured logging pipeline for the chatbot scripts")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("bench", help="Request throughput with print-based logging vs the pipeline")
+    bench.add_argument("--chats", type=int, default=1000)
+    bench.add_argument("--turns", type=int, default=5)
+    bench.add_argument("--sink", default="tty", help="tty (terminal-speed reader), pipe, devnull, or a file path")
+    bench.add_argument("--sample", default="DEBUG=0.05", help="Sample rates for the sampled run")
+
+    child = sub.add_parser("_child")
+    child.add_argument("--chats", type=int)
+    child.add_argument("--turns", type=int)
+
+    args = parser.parse_args()
+    if args.command == "_child":
+        bench_child(args.chats, args.turns)
+        return
+
+    print(f"⏱️ {args.chats} chats x {args.turns} turns on a zero-latency mock, stdout -> {args.sink}")
+    runs = [("print (old)", "print", ""), ("pipeline", "async", ""), (f"pipeline + {args.sample}", "async", args.sample)]
+    baseline = None
+    for label, mode, sample in runs:
+        result = run_bench_mode(mode, args.sink, args.chats, args.turns, sample)
+        throughput = result["requests"] / result["seconds"]
+        baseline = baseline or throughput
+        print(f"   {label:<28} {throughput:>9.0f} req/s ({throughput / baseline:.2f}x) | "
+              f"{result['written']} lines, {result['sampled_out']} sampled out, {result['dropped']} dropped, "
+              f"drain {result['drain_seconds']:.2f}s")
+
+if __name__ == "__main__":
+    main()
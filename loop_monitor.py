@@ -0,0 +1,254 @@
+"""
+loop_monitor.py
+Profiling surface for the chatbot process's event loop. Off by default (LOOP_MONITOR=1 to enable).
+- Loop-lag probe: a periodic task measures how late it wakes up; lags go into a histogram
+- Slow-callback detector: a watchdog thread notices when the loop stops ticking and captures
+  the loop thread's live stack and current task, i.e. the code that is blocking every user
+- Sampling profiler: toggled on demand (SIGUSR2 or toggle_profiler()); samples the loop
+  thread's stack and writes folded stacks (flamegraph format) when stopped, from the sampler
+  thread so the loop is never blocked by the profiler itself
+
+Cost when on: one short task wake-up per probe interval and a watchdog thread that checks a
+timestamp; the sampler only runs while toggled on.
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import threading
+import traceback
+from collections import Counter
+from typing import Dict, List, Optional, Any
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR", "0") == "1"
+PROBE_INTERVAL = 0.1           # Seconds between lag probes
+SLOW_CALLBACK_THRESHOLD = 0.1  # Loop blocked this long = report the offending stack
+SAMPLE_INTERVAL = 0.005        # Profiler sampling period
+MAX_SLOW_REPORTS = 100         # Most recent slow-callback reports kept
+STACK_DEPTH = 12               # Frames kept per report / profiler sample
+PROFILE_OUTPUT = os.getenv("LOOP_PROFILE_OUTPUT", "loop_profile.folded")
+
+# Histogram bucket upper bounds in milliseconds (last bucket catches everything above)
+LAG_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float("inf")]
+
+# ============================================================================
+# SECTION 2: LOOP MONITOR
+# ============================================================================
+
+class LoopMonitor:
+    def __init__(self, probe_interval: float = PROBE_INTERVAL,
+                 slow_threshold: float = SLOW_CALLBACK_THRESHOLD,
+                 sample_interval: float = SAMPLE_INTERVAL):
+        self.probe_interval = probe_interval
+        self.slow_threshold = slow_threshold
+        self.sample_interval = sample_interval
+
+        self.lag_counts = [0] * len(LAG_BUCKETS_MS)
+        self.max_lag = 0.0
+        self.probes = 0
+        self.slow_reports: List[Dict[str, Any]] = []
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.perf_counter()
+        self._probe_task: Optional[asyncio.Task] = None
+        self._stopping = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+        self._profiling = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._samples: Counter = Counter()
+        self._profile_path = PROFILE_OUTPUT
+        self._signal_installed = False
+
+    # ---- Lifecycle ----
+
+    def start(self):
+        """Start the probe and watchdog (call from inside the running loop)"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stopping.clear()
+        self._probe_task = self._loop.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def install_signal_handler(self) -> bool:
+        """SIGUSR2 toggles the sampling profiler (Unix, main thread only)"""
+        if not hasattr(signal, "SIGUSR2"):
+            return False
+        try:
+            self._loop.add_signal_handler(signal.SIGUSR2, self.toggle_profiler)
+        except (NotImplementedError, RuntimeError):
+            return False  # Not the main thread, or the loop doesn't support signals
+        self._signal_installed = True
+        return True
+
+    async def stop(self):
+        self._stopping.set()
+        if self._signal_installed:
+            self._loop.remove_signal_handler(signal.SIGUSR2)
+            self._signal_installed = False
+        if self._profiling.is_set():
+            self.stop_profiler()
+        if self._sampler:
+            await asyncio.to_thread(self._sampler.join)  # Profile file written
+        if self._probe_task:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+
+    # ---- Lag probe ----
+
+    async def _probe(self):
+        while True:
+            expected = time.perf_counter() + self.probe_interval
+            await asyncio.sleep(self.probe_interval)
+            now = time.perf_counter()
+            self._heartbeat = now
+            self._record_lag(max(0.0, now - expected))
+
+    def _record_lag(self, lag: float):
+        self.probes += 1
+        self.max_lag = max(self.max_lag, lag)
+        lag_ms = lag * 1000
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.lag_counts[i] += 1
+                return
+
+    def lag_histogram(self) -> Dict[str, int]:
+        labels = [f"<={bound:g}ms" if bound != float("inf") else f">{LAG_BUCKETS_MS[-2]:g}ms"
+                  for bound in LAG_BUCKETS_MS]
+        return dict(zip(labels, self.lag_counts))
+
+    # ---- Slow-callback watchdog ----
+
+    def _current_task_name(self) -> Optional[str]:
+        # Best effort read from another thread; the loop may switch tasks meanwhile
+        task = asyncio.tasks._current_tasks.get(self._loop)
+        if task is None:
+            return None
+        coro = task.get_coro()
+        return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+    def _loop_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        return [line.rstrip() for line in traceback.format_stack(frame)[-STACK_DEPTH:]]
+
+    def _watch(self):
+        reported = None
+        check_every = min(self.slow_threshold / 2, self.probe_interval)
+        while not self._stopping.wait(check_every):
+            heartbeat = self._heartbeat
+            blocked = time.perf_counter() - heartbeat - self.probe_interval
+            if blocked < self.slow_threshold:
+                continue
+            task = self._current_task_name()
+            if (heartbeat, task) == reported:
+                continue
+            reported = (heartbeat, task)  # One report per stall and offending task
+            report = {
+                "blocked_for": round(blocked, 3),
+                "task": task,
+                "stack": self._loop_stack(),
+                "at": time.time(),
+            }
+            self.slow_reports = (self.slow_reports + [report])[-MAX_SLOW_REPORTS:]
+            print(f"🐢 Event loop blocked for {blocked * 1000:.0f}ms+ in task {report['task']}", file=sys.stderr)
+            for line in report["stack"][-4:]:
+                print(f"   {line}", file=sys.stderr)
+
+    # ---- Sampling profiler ----
+
+    def start_profiler(self):
+        if self._profiling.is_set():
+            return
+        self._profiling = threading.Event()  # Own flag per run: a previous sampler may still be writing
+        self._profiling.set()
+        self._sampler = threading.Thread(target=self._sample, args=(self._profiling,),
+                                         name="loop-sampler", daemon=True)
+        self._sampler.start()
+        print(f"🔬 Loop sampling profiler ON (every {self.sample_interval * 1000:.0f}ms)")
+
+    def stop_profiler(self, path: str = PROFILE_OUTPUT) -> str:
+        """Stop sampling; the sampler thread writes the folded stacks to path (returns right away)"""
+        self._profile_path = path
+        self._profiling.clear()
+        return path
+
+    def _write_profile(self, samples: Counter, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"🔬 Loop sampling profiler OFF: {sum(samples.values())} samples written to {path}")
+
+    def toggle_profiler(self):
+        if self._profiling.is_set():
+            self.stop_profiler()
+        else:
+            self.start_profiler()
+
+    def _sample(self, profiling: threading.Event):
+        samples = self._samples = Counter()
+        while profiling.is_set():
+            frame = sys._current_frames().get(self._loop_thread_id)
+            names = []
+            while frame is not None and len(names) < STACK_DEPTH * 4:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                samples[";".join(reversed(names))] += 1
+            time.sleep(self.sample_interval)
+        self._write_profile(samples, self._profile_path)
+
+    # ---- Report ----
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "probes": self.probes,
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "lag_histogram": self.lag_histogram(),
+            "slow_callbacks": len(self.slow_reports),
+        }
+
+    def print_report(self):
+        report = self.report()
+        print(f"\n⏱️ EVENT LOOP LAG ({report['probes']} probes, max {report['max_lag_ms']}ms)")
+        peak = max(self.lag_counts) or 1
+        for label, count in report["lag_histogram"].items():
+            print(f"   {label:>9} {count:>7}  {'█' * round(30 * count / peak)}")
+        print(f"   Slow callbacks detected: {report['slow_callbacks']}")
+        for slow in self.slow_reports[-3:]:
+            print(f"   🐢 {slow['blocked_for'] * 1000:.0f}ms+ in {slow['task']}")
+            if slow["stack"]:
+                print(f"      {slow['stack'][-1].splitlines()[0].strip()}")
+
+# ============================================================================
+# SECTION 3: STARTUP HOOK
+# ============================================================================
+
+def install_loop_monitor(force: bool = False) -> Optional[LoopMonitor]:
+    """
+    Start a LoopMonitor if LOOP_MONITOR=1 (or force). On Unix, SIGUSR2 toggles the
+    sampling profiler of the running process:  kill -USR2 <pid>
+    Call from inside the running loop.
+    """
+    if not (LOOP_MONITOR_ENABLED or force):
+        return None
+    monitor = LoopMonitor()
+    monitor.start()
+    monitor.install_signal_handler()  # Removed again by monitor.stop()
+    print(f"⏱️ Loop monitor on (pid {os.getpid()}, kill -USR2 to toggle the sampling profiler)")
+    return monitor
@@ -3,24 +3,59 @@ import asyncio
 import time
 import uuid
 import pandas as pd
-from openai import OpenAI
 from dotenv import load_dotenv
+from scheduler import FairScheduler, estimate_request_cost
+from client_pool import ClientPool, ChainUnavailable
+from timeline_analysis import analyze, print_summary
+from loop_monitor import install_loop_monitor
+from log_pipeline import get_logger, flush_logs
+from usage_tracker import UsageTracker
+from session_snapshot import open_store, snapshot_periodically
+from conversation_state import CONVERSATION_MODE, MODE_STATELESS, append_turn, build_input, message_item, stateless_payload
+import runtime
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client_pool = ClientPool.from_env()
+log = get_logger("mainasync")  # Queued to a background writer (see log_pipeline.py)
 
 timeline = []
-user_cache = {}
+# user_id -> {"response_id", "endpoint"} (the key holding the chain); survives restarts when SESSION_SNAPSHOT_DIR is set (see session_snapshot.py)
+# With CONVERSATION_MODE=stateless: user_id -> compact turn list, sent with store=false (see conversation_state.py)
+user_cache = open_store("user_cache")
+
+# Tokens / cached tokens / latency per user and model (see usage_tracker.py)
+usage_tracker = UsageTracker()
+
+# Caps concurrent upstream calls and shares them fairly across users
+scheduler = FairScheduler(max_concurrent=int(os.getenv("MAX_CONCURRENT_UPSTREAM", "16")))
+
+def cached_chain(user_id):
+    """(previous_response_id, endpoint) from user_cache; entries saved as a bare id have no known endpoint"""
+    cached = user_cache.get(user_id)
+    if isinstance(cached, dict):
+        return cached.get("response_id"), cached.get("endpoint")
+    if isinstance(cached, str):
+        return cached, None
+    return None, None  # A turn list saved in stateless mode: start a new chain
+
+def cached_turns(user_id):
+    """Stateless turn list from user_cache (a chain saved in chained mode starts an empty list)"""
+    cached = user_cache.get(user_id)
+    return cached if isinstance(cached, list) else []
 
 async def send_message(user_id, correlation_id, message):
-    previous_response_id = user_cache.get(user_id)
+    stateless = CONVERSATION_MODE == MODE_STATELESS
+    previous_response_id, chain_owner = (None, None) if stateless else cached_chain(user_id)
 
     payload = {
         "model": "gpt-4.1-mini",
         "input": message
     }
 
-    if previous_response_id:
+    if stateless:
+        payload["input"] = build_input(None, cached_turns(user_id), [message_item("user", message)])
+        stateless_payload(payload)
+    elif previous_response_id:
         payload["previous_response_id"] = previous_response_id
 
     sent_time = time.time()
@@ -36,20 +71,38 @@ async def send_message(user_id, correlation_id, message):
         "text": message
     })
 
-    print(f"\n➡️ Sending ({correlation_id}) from {user_id} at {sent_time:.3f}s")
-    print(f"   Payload sent: {payload}")
+    # One record per block so lines from different users never interleave
+    fields = {"chat_id": user_id, "correlation_id": correlation_id}
+    log.info(f"\n➡️ Sending ({correlation_id}) from {user_id} at {sent_time:.3f}s", extra=fields)
+    log.debug(f"   Payload sent: {payload}", extra=fields)
 
     # ---- CALL ----
     # Using asyncio.to_thread to run the blocking call in a separate thread
     # It will not block the main event loop, allowing other coroutines to run concurrently and keep the responses to the correct user. 
     # Because the thread that sent the request will handle the respective response when it comes back. Hence, no mix-up of responses between users.
-    response = await asyncio.to_thread(client.responses.create, **payload)
+    # The scheduler holds the call until this user gets a fair share of the upstream slots.
+    # The client pool still runs the blocking call via asyncio.to_thread, on the key that owns this user's chain.
+    async with scheduler.slot(user_id, cost=estimate_request_cost(payload)):
+        upstream_started = time.time()
+        try:
+            response = await client_pool.create(payload, owner=chain_owner)
+        except ChainUnavailable as error:
+            # The key owning this user's chain is unknown or down: continue as a new conversation
+            log.warning(f"🔗 {user_id}: {error}, starting a new conversation", extra=fields)
+            payload.pop("previous_response_id", None)
+            response = await client_pool.create(payload)
     # Each blocking call to OpenAI API is run in its own thread, allowing multiple calls to be in-flight simultaneously. So more threads = more parallel users.
 
     received_time = time.time()
 
-    # Store the new OPENAI response ID as memory context
-    user_cache[user_id] = response.id
+    # Store the new OPENAI response ID as memory context (or the turn itself when stateless)
+    if stateless:
+        user_cache[user_id], _ = append_turn(cached_turns(user_id), message, response.output_text)
+    else:
+        user_cache[user_id] = {"response_id": response.id, "endpoint": client_pool.owner_of(response.id)}
+
+    usage = usage_tracker.record(response, user_id, model=payload["model"],
+                                 latency=received_time - upstream_started, correlation_id=correlation_id)
 
     # Extract internal request ID if available
     internal_req_id = getattr(response, "request_id", None)
@@ -63,14 +116,17 @@ async def send_message(user_id, correlation_id, message):
         "payload": output,
         "response_id": response.id,
         "internal_request_id": internal_req_id,
-        "text": output
+        "text": output,
+        "input_tokens": usage["input_tokens"],
+        "cached_tokens": usage["cached_tokens"],
+        "output_tokens": usage["output_tokens"]
     })
 
-    print(f"\n🔹 Received response for {correlation_id} | User: {user_id}")
-    print(f"   🔗 Correlation ID (Client): {correlation_id}")
-    print(f"   🔗 OpenAI Response ID:      {response.id}")
-    print(f"   🔗 OpenAI Internal Req ID:  {internal_req_id}")
-    print(f"   Text: {output}\n")
+    log.info(f"\n🔹 Received response for {correlation_id} | User: {user_id}\n"
+             f"   🔗 Correlation ID (Client): {correlation_id}\n"
+             f"   🔗 OpenAI Response ID:      {response.id}\n"
+             f"   🔗 OpenAI Internal Req ID:  {internal_req_id}\n"
+             f"   Text: {output}\n", extra={**fields, "response_id": response.id})
 
     return {
         "user_id": user_id,
@@ -140,7 +196,12 @@ async def main():
     }
 
     print("\n🔵 Running async multi-user stress test...\n")
-    
+
+    # Event loop lag / slow-callback monitor (only when LOOP_MONITOR=1)
+    loop_monitor = install_loop_monitor()
+
+    # Periodic user_cache snapshots (final one on shutdown) when SESSION_SNAPSHOT_DIR is set
+    snapshot_task = asyncio.create_task(snapshot_periodically(user_cache)) if user_cache.path else None
 
     #Main part that makes python know to run multiple user sessions concurrently 
     tasks = [user_session(uid, msgs) for uid, msgs in users.items()]
@@ -150,6 +211,7 @@ async def main():
     sorted_log = sorted(timeline, key=lambda x: x["time"])
     t0 = sorted_log[0]["time"]
 
+    flush_logs()  # Per-request logs first, then the report
     print("\n📊 FINAL MESSAGE FLOW LOG\n")
     print(f"{'Time':<7}{'Event':<10}{'User':<6}{'ClientCorrID':<12}{'ResponseID':<24}{'InternalReqID'}")
     print("-"*110)
@@ -165,5 +227,24 @@ async def main():
     df.to_excel("async_debug_log.xlsx", index=False)
     print("\n📁 Saved debug log to: async_debug_log.xlsx")
 
+    # In-flight concurrency, per-user latency and overlap, computed column-wise
+    print_summary(analyze(sorted_log))
+
+    # Token usage next to the timeline: tokens/sec and prompt-cache hit ratio per user / model
+    usage_tracker.print_report()
+    usage_tracker.export_json("async_usage_log.json")
+    print("📁 Saved usage log to: async_usage_log.json")
+
+    if loop_monitor:
+        loop_monitor.print_report()
+        await loop_monitor.stop()
+
+    if snapshot_task:
+        snapshot_task.cancel()
+        try:
+            await snapshot_task
+        except asyncio.CancelledError:
+            pass
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    runtime.run(main())
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+memory_index.py
+Per-chat long-term memory: embeddings of past turns in a compact NumPy matrix (optionally
+memory-mapped to one file per chat), with vectorized top-k retrieval. On a context reset the
+chatbot injects only the most relevant past turns instead of resending raw history.
+"""
+
+import os
+import re
+import time
+import json
+import numpy as np
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Any
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = 256        # text-embedding-3 models can be shortened; 256 keeps rows small
+MEMORY_DTYPE = np.float16         # Storage type; similarities are computed in float32
+INITIAL_CAPACITY = 4              # Rows allocated on a chat's first turn, doubled as it grows
+MAX_TURN_CHARS = 2000             # Stored text per turn (the embedding sees the same text)
+# Open indexes kept (LRU). Evicted chats: memmaps closed and reopened from MEMORY_DIR on demand,
+# or forgotten when memory is in-process only. Stays well below vm.max_map_count (~65k)
+MAX_OPEN_INDEXES = int(os.getenv("MEMORY_MAX_OPEN_INDEXES", "10000"))
+
+EmbedFn = Callable[[List[str]], Awaitable[np.ndarray]]
+
+# ============================================================================
+# SECTION 2: EMBEDDING BACKENDS
+# ============================================================================
+
+def pool_embedder(pool: Any, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS,
+                  on_response: Optional[Callable[[Any, float], Any]] = None) -> EmbedFn:
+    """
+    Embeddings through a ClientPool (client.embeddings.create on the best endpoint).
+    on_response(response, latency) runs after each call, e.g. to record token usage.
+    """
+    async def embed(texts: List[str]) -> np.ndarray:
+        started = time.perf_counter()
+        response = await pool.create_embeddings({"model": model, "input": texts, "dimensions": dimensions})
+        if on_response:
+            on_response(response, time.perf_counter() - started)
+        rows = sorted(response.data, key=lambda item: item.index)
+        return np.asarray([row.embedding for row in rows], dtype=np.float32)
+    return embed
+
+def local_embedder(dimensions: int = EMBEDDING_DIMENSIONS) -> EmbedFn:
+    """Offline stand-in for the embeddings endpoint (hashing trick, see mock_backend.py)"""
+    from mock_backend import hash_embedding
+
+    async def embed(texts: List[str]) -> np.ndarray:
+        return np.asarray([hash_embedding(text, dimensions) for text in texts], dtype=np.float32)
+    return embed
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+# ============================================================================
+# SECTION 3: PER-CHAT INDEX
+# ============================================================================
+
+class ChatMemoryIndex:
+    """
+    Embedding matrix + turn texts for one chat.
+    - In memory: a growable NumPy array (doubling capacity), allocated on the first add
+    - With path: <path>.npy memory-mapped with np.load(mmap_mode) and <path>.jsonl for the texts
+    """
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS, path: Optional[str] = None):
+        self.dimensions = dimensions
+        self.path = path
+        self.turns: List[Dict] = []
+        self.vectors: Optional[np.ndarray] = None  # Nothing allocated until the chat has a turn
+
+        if path and os.path.exists(f"{path}.jsonl"):
+            with open(f"{path}.jsonl", "r", encoding="utf-8") as f:
+                self.turns = [json.loads(line) for line in f if line.strip()]
+            self.vectors = np.load(f"{path}.npy", mmap_mode="r+")
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def close(self):
+        """Flush and release the memmap (the index can be reopened from its files)"""
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+        self.vectors = None
+
+    def _ensure_capacity(self, needed: int):
+        if self.vectors is None:
+            self.vectors = np.zeros((max(needed, INITIAL_CAPACITY), self.dimensions), dtype=MEMORY_DTYPE)
+            return
+        capacity = self.vectors.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        if self.path:
+            grown = np.lib.format.open_memmap(f"{self.path}.npy.tmp", mode="w+", dtype=MEMORY_DTYPE,
+                                              shape=(new_capacity, self.dimensions))
+            grown[:capacity] = self.vectors
+            grown.flush()
+            del self.vectors
+            os.replace(f"{self.path}.npy.tmp", f"{self.path}.npy")
+            self.vectors = np.load(f"{self.path}.npy", mmap_mode="r+")
+        else:
+            grown = np.zeros((new_capacity, self.dimensions), dtype=MEMORY_DTYPE)
+            grown[:capacity] = self.vectors
+            self.vectors = grown
+
+    def add(self, turns: List[Dict], embeddings: np.ndarray):
+        """Append turns (JSON-serializable dicts) with their embeddings"""
+        start = len(self.turns)
+        if self.path and not isinstance(self.vectors, np.memmap):
+            self.vectors = np.lib.format.open_memmap(f"{self.path}.npy", mode="w+", dtype=MEMORY_DTYPE,
+                                                     shape=(max(len(turns), INITIAL_CAPACITY), self.dimensions))
+        self._ensure_capacity(start + len(turns))
+        self.vectors[start:start + len(turns)] = normalize_rows(embeddings).astype(MEMORY_DTYPE)
+        self.turns.extend(turns)
+
+        if self.path:
+            self.vectors.flush()
+            with open(f"{self.path}.jsonl", "a", encoding="utf-8") as f:
+                for turn in turns:
+                    f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+
+    def search(self, query: np.ndarray, k: int) -> List[Dict]:
+        """Top-k turns by cosine similarity, returned in chronological order"""
+        count = len(self.turns)
+        if count == 0 or k <= 0:
+            return []
+        query = normalize_rows(query.reshape(1, -1).astype(np.float32))[0]
+        scores = self.vectors[:count].astype(np.float32) @ query
+
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top.sort()  # Chronological order reads better as context
+        return [{**self.turns[i], "score": float(scores[i])} for i in top]
+
+# ============================================================================
+# SECTION 4: MEMORY STORE (ALL CHATS)
+# ============================================================================
+
+def safe_file_name(chat_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", chat_id)
+
+class MemoryStore:
+    """chat_id -> ChatMemoryIndex (LRU of at most max_open), with one shared embedding function"""
+
+    def __init__(self, embed_fn: EmbedFn, dimensions: int = EMBEDDING_DIMENSIONS,
+                 directory: Optional[str] = None, max_open: int = MAX_OPEN_INDEXES):
+        self.embed_fn = embed_fn
+        self.dimensions = dimensions
+        self.directory = directory
+        self.max_open = max_open
+        self.indexes: "OrderedDict[str, ChatMemoryIndex]" = OrderedDict()
+        self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def index_for(self, chat_id: str) -> ChatMemoryIndex:
+        index = self.indexes.get(chat_id)
+        if index is not None:
+            self.indexes.move_to_end(chat_id)
+            return index
+
+        path = os.path.join(self.directory, safe_file_name(chat_id)) if self.directory else None
+        index = self.indexes[chat_id] = ChatMemoryIndex(self.dimensions, path)
+        while len(self.indexes) > self.max_open:
+            _, evicted = self.indexes.popitem(last=False)
+            evicted.close()
+            self.evictions += 1
+        return index
+
+    async def remember_turn(self, chat_id: str, user_message: str, ai_response: str):
+        """Embed and store one user/assistant pair (one row per pair)"""
+        text = f"User: {user_message}\nAssistant: {ai_response}"[:MAX_TURN_CHARS]
+        embeddings = await self.embed_fn([text])
+        self.index_for(chat_id).add([{
+            "user": user_message[:MAX_TURN_CHARS],
+            "assistant": ai_response[:MAX_TURN_CHARS],
+        }], embeddings)
+
+    async def recall(self, chat_id: str, query: str, k: int) -> List[Dict]:
+        """Top-k past pairs most relevant to query, as [{role, message}] ready for a new session"""
+        if not len(self.index_for(chat_id)):
+            return []
+        query_embedding = (await self.embed_fn([query[:MAX_TURN_CHARS]]))[0]
+        messages = []
+        # Look the index up again: it may have been evicted (closed) while embedding
+        for turn in self.index_for(chat_id).search(query_embedding, k):
+            messages.append({"role": "user", "message": turn["user"]})
+            messages.append({"role": "assistant", "message": turn["assistant"]})
+        return messages
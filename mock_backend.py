@@ -0,0 +1,255 @@
+"""
+mock_backend.py
+Local stand-in for the OpenAI Responses API, for load tests, replays and benchmarks.
+Returns objects shaped like real responses (id, output, output_text, usage) after a
+configurable latency, without any network calls or API keys.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import zlib
+import math
+import threading
+import contextvars
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Union, Any
+from client_pool import ClientPool, Endpoint
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+DEFAULT_LATENCY = 0.05       # Seconds per mock call
+CHARS_PER_TOKEN = 4          # Rough token estimate for usage numbers
+EMBEDDING_DIMENSIONS = 256   # Default size of mock embeddings
+PROMPT_CACHE_MIN_TOKENS = 1024   # Like the real prompt cache: shorter prefixes are never cached
+MAX_PREFIX_CACHE_ENTRIES = 200_000  # Prefix hashes remembered before the oldest are evicted
+
+# Callers can set a per-call latency (e.g. the recorded latency during a replay).
+# asyncio.to_thread copies the context, so the value reaches the worker thread.
+LATENCY_HINT: contextvars.ContextVar = contextvars.ContextVar("mock_latency_hint", default=None)
+
+# Callers can set a list here to collect the mock latency of every call made in their context
+# (e.g. to separate engine overhead from upstream time during a replay)
+UPSTREAM_SECONDS: contextvars.ContextVar = contextvars.ContextVar("mock_upstream_seconds", default=None)
+
+PLACEHOLDER_API_KEY = "sk-mock-placeholder"
+
+def ensure_placeholder_credentials():
+    """
+    The engines build ClientPool.from_env() at import time, which needs some API key.
+    Offline tools swap in the mock pool anyway: give them a placeholder if nothing is configured.
+    """
+    if not (os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEYS") or os.getenv("OPENAI_POOL_CONFIG")):
+        os.environ["OPENAI_API_KEY"] = PLACEHOLDER_API_KEY
+
+class MockUpstreamError(Exception):
+    """Injected server error (status 500), counted by the client pool's circuit breaker"""
+    status_code = 500
+
+# ============================================================================
+# SECTION 2: RESPONSE BUILDING
+# ============================================================================
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+def input_text(payload: Dict) -> str:
+    """Flatten the 'input' of a Responses API payload into plain text"""
+    data = payload.get("input", "")
+    if isinstance(data, str):
+        return data
+    return "\n".join(str(item.get("content", "")) for item in data if isinstance(item, dict))
+
+def default_reply(payload: Dict) -> str:
+    text = input_text(payload).strip().splitlines()
+    last_line = text[-1] if text else ""
+    return f"Mock reply to: {last_line[:120]}"
+
+def build_response(response_id: str, text: str, input_tokens: int, cached_tokens: int) -> SimpleNamespace:
+    output_tokens = count_tokens(text)
+    return SimpleNamespace(
+        id=response_id,
+        object="response",
+        output_text=text,
+        output=[SimpleNamespace(
+            type="message",
+            role="assistant",
+            content=[SimpleNamespace(type="output_text", text=text)],
+        )],
+        usage=SimpleNamespace(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+            input_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+            output_tokens_details=SimpleNamespace(reasoning_tokens=0),
+        ),
+    )
+
+def hash_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """
+    Deterministic bag-of-words embedding (hashing trick, L2-normalized).
+    Texts sharing words get similar vectors, which is enough to test retrieval offline.
+    """
+    vector = [0.0] * dimensions
+    for word in text.lower().split():
+        word = word.strip(".,!?;:()[]\"'")
+        if not word:
+            continue
+        h = zlib.crc32(word.encode("utf-8"))
+        vector[h % dimensions] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+# ============================================================================
+# SECTION 3: MOCK CLIENT
+# ============================================================================
+
+class MockEmbeddings:
+    """Implements client.embeddings.create(model=..., input=..., dimensions=...)"""
+
+    def create(self, input: Union[str, List[str]], model: str = "mock-embedding",
+               dimensions: int = EMBEDDING_DIMENSIONS, **_) -> SimpleNamespace:
+        texts = [input] if isinstance(input, str) else list(input)
+        return SimpleNamespace(
+            model=model,
+            data=[SimpleNamespace(index=i, embedding=hash_embedding(text, dimensions))
+                  for i, text in enumerate(texts)],
+            usage=SimpleNamespace(prompt_tokens=sum(count_tokens(t) for t in texts),
+                                  total_tokens=sum(count_tokens(t) for t in texts)),
+        )
+
+class MockResponses:
+    """Implements client.responses.create(**payload) (blocking, like the sync SDK)"""
+
+    def __init__(self, owner: "MockOpenAI"):
+        self._owner = owner
+
+    def create(self, **payload) -> SimpleNamespace:
+        return self._owner.create_response(payload)
+
+class MockAsyncResponses:
+    """Implements client.responses.create(**payload) as a coroutine, like AsyncOpenAI"""
+
+    def __init__(self, owner: "MockOpenAI"):
+        self._owner = owner
+
+    async def create(self, **payload) -> SimpleNamespace:
+        return await self._owner.create_response_async(payload)
+
+class MockOpenAI:
+    """
+    Drop-in for OpenAI(...) in tests:
+    - latency: seconds, or a function(payload) -> seconds
+    - reply_fn: function(payload) -> reply text
+    - fail_every: every Nth call raises (0 = never), to exercise retries / breakers
+    - prefill_latency: extra seconds per uncached input token (0 = flat latency)
+    Server-side chains (previous_response_id) are tracked so usage numbers grow
+    with the conversation, and the chained prefix counts as cached input.
+    List inputs also hit a prompt cache: the longest previously seen run of leading
+    items (at least PROMPT_CACHE_MIN_TOKENS) counts as cached input, as with store=false.
+    """
+
+    def __init__(self, latency: Union[float, Callable[[Dict], float]] = DEFAULT_LATENCY,
+                 reply_fn: Optional[Callable[[Dict], str]] = None, fail_every: int = 0,
+                 prefill_latency: float = 0.0, **client_kwargs):
+        self.latency = latency
+        self.reply_fn = reply_fn or default_reply
+        self.fail_every = fail_every
+        self.prefill_latency = prefill_latency
+        self.client_kwargs = client_kwargs
+        self.responses = MockResponses(self)
+        self.embeddings = MockEmbeddings()
+        self.calls = 0
+        self._chain_tokens: Dict[str, int] = {}  # response_id -> context tokens so far
+        self._prefix_cache: Dict[int, None] = {}  # Hashes of input prefixes seen (insertion order = age)
+        self._lock = threading.Lock()
+
+    def latency_for(self, payload: Dict) -> float:
+        hint = LATENCY_HINT.get()
+        if hint is not None:
+            return hint
+        return self.latency(payload) if callable(self.latency) else self.latency
+
+    def _count_call(self):
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+        if self.fail_every and call_number % self.fail_every == 0:
+            raise MockUpstreamError(f"Mock upstream error on call {call_number}")
+
+    def delay_for(self, payload: Dict, response: SimpleNamespace) -> float:
+        """Base latency plus prefill time for the input tokens the cache did not cover"""
+        usage = response.usage
+        uncached = usage.input_tokens - usage.input_tokens_details.cached_tokens
+        delay = self.latency_for(payload) + self.prefill_latency * uncached
+        collected = UPSTREAM_SECONDS.get()
+        if collected is not None:
+            collected.append(delay)
+        return delay
+
+    def create_response(self, payload: Dict) -> SimpleNamespace:
+        self._count_call()
+        response = self.respond(payload)
+        delay = self.delay_for(payload, response)
+        if delay > 0:
+            time.sleep(delay)
+        return response
+
+    async def create_response_async(self, payload: Dict) -> SimpleNamespace:
+        self._count_call()
+        response = self.respond(payload)
+        delay = self.delay_for(payload, response)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return response
+
+    def cached_prefix_tokens(self, payload: Dict) -> int:
+        """Tokens of the longest leading run of input items already seen (then remember this input)"""
+        data = payload.get("input")
+        if not isinstance(data, list):
+            return 0
+        prefix_hash, tokens, cached = hash(payload.get("previous_response_id")), 0, 0
+        with self._lock:
+            for item in data:
+                if not isinstance(item, dict):
+                    break
+                prefix_hash = hash((prefix_hash, item.get("role"), str(item.get("content", ""))))
+                tokens += count_tokens(str(item.get("content", "")))
+                if prefix_hash in self._prefix_cache:
+                    cached = tokens
+                else:
+                    self._prefix_cache[prefix_hash] = None
+            while len(self._prefix_cache) > MAX_PREFIX_CACHE_ENTRIES:
+                del self._prefix_cache[next(iter(self._prefix_cache))]
+        return cached if cached >= PROMPT_CACHE_MIN_TOKENS else 0
+
+    def respond(self, payload: Dict) -> SimpleNamespace:
+        """Build the response without sleeping (used directly by simulated clocks)"""
+        text = self.reply_fn(payload)
+        previous_tokens = self._chain_tokens.get(payload.get("previous_response_id"), 0)
+        new_tokens = count_tokens(input_text(payload))
+        cached_tokens = previous_tokens + min(self.cached_prefix_tokens(payload), new_tokens)
+        response_id = f"resp_mock_{uuid.uuid4().hex}"
+
+        if payload.get("store", True):
+            self._chain_tokens[response_id] = previous_tokens + new_tokens + count_tokens(text)
+        return build_response(response_id, text, previous_tokens + new_tokens, cached_tokens)
+
+class MockAsyncOpenAI(MockOpenAI):
+    """Drop-in for AsyncOpenAI(...): same behaviour, latency awaited on the event loop (no threads)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.responses = MockAsyncResponses(self)
+
+def mock_pool(endpoints: int = 1, requests_per_minute: float = 1e9, asynchronous: bool = False,
+              **mock_kwargs: Any) -> ClientPool:
+    """ClientPool backed by MockOpenAI endpoints (MockAsyncOpenAI with asynchronous=True)"""
+    client_class = MockAsyncOpenAI if asynchronous else MockOpenAI
+    return ClientPool([
+        Endpoint(f"mock{i}", client_class(**mock_kwargs), requests_per_minute=requests_per_minute)
+        for i in range(endpoints)
+    ])
@@ -0,0 +1,256 @@
+"""
+replay.py
+Trace-replay load generator for recorded timelines such as async_debug_log.json.
+Rebuilds each user's arrival and think-time pattern from the log, replays it at 1x or Nx
+speed against the chatbot engine on the local mock backend, and reports latency
+differences against the recorded run.
+
+Usage:
+    python replay.py async_debug_log.json --speed 10
+    python replay.py soak_log.jsonl --speed 50 --engine mainasync --latency 0.2
+"""
+
+import asyncio
+import argparse
+import json
+import math
+import time
+import uuid
+from typing import Dict, List, Optional, Any
+from log_pipeline import flush_logs
+
+# ============================================================================
+# SECTION 1: LOADING TIMELINE LOGS
+# ============================================================================
+
+def load_timeline(path: str) -> List[Dict]:
+    """
+    Load timeline events from:
+    - JSON: a list of events (async_debug_log.json)
+    - JSONL: one event per line
+    - Streaming: JSON objects appended back to back, as written by a live logger
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+
+    stripped = raw.lstrip()
+    if stripped.startswith("["):
+        return json.loads(stripped)
+
+    decoder = json.JSONDecoder()
+    events, pos = [], 0
+    while True:
+        # Skip whitespace / newlines between records (covers JSONL and streaming logs)
+        while pos < len(raw) and raw[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(raw):
+            break
+        event, pos = decoder.raw_decode(raw, pos)
+        events.append(event)
+    return events
+
+# ============================================================================
+# SECTION 2: REBUILDING TRAFFIC SHAPE
+# ============================================================================
+
+def build_user_scripts(events: List[Dict]) -> Dict[str, List[Dict]]:
+    """
+    Turn raw send/receive events into per-user scripts:
+    user_id -> [{ correlation_id, message, delay, recorded_latency }]
+    delay is the time to wait before sending: offset from the start of the trace for a
+    user's first message, think time after the previous reply for the following ones.
+    """
+    sends = sorted((e for e in events if e.get("event") == "send"), key=lambda e: e["time"])
+    receive_times = {e["correlation_id"]: e["time"] for e in events if e.get("event") == "receive"}
+    if not sends:
+        return {}
+
+    t0 = sends[0]["time"]
+    scripts: Dict[str, List[Dict]] = {}
+    last_receive: Dict[str, float] = {}
+
+    for event in sends:
+        user_id = event["user_id"]
+        correlation_id = event["correlation_id"]
+        received = receive_times.get(correlation_id)
+
+        previous = last_receive.get(user_id)
+        delay = event["time"] - (previous if previous is not None else t0)
+
+        scripts.setdefault(user_id, []).append({
+            "correlation_id": correlation_id,
+            "message": event.get("text") or "",
+            "delay": max(0.0, delay),
+            "recorded_latency": (received - event["time"]) if received is not None else None,
+        })
+        last_receive[user_id] = received if received is not None else event["time"]
+
+    return scripts
+
+# ============================================================================
+# SECTION 3: ENGINE ADAPTERS (MOCK BACKEND)
+# ============================================================================
+
+def make_engine(name: str, latency: Optional[float]):
+    """
+    Return an async function(user_id, message) that runs one turn through the engine,
+    with the engine's client pool swapped for the mock backend.
+    latency=None reuses each request's recorded latency (scaled by speed) as the mock latency.
+    """
+    from mock_backend import mock_pool, ensure_placeholder_credentials
+
+    ensure_placeholder_credentials()  # Importing an engine builds ClientPool.from_env()
+    pool = mock_pool(latency=latency or 0.0)
+
+    if name == "chatbot":
+        import responsesAPIchatbot as engine
+        engine.client_pool = pool
+
+        async def run_turn(user_id: str, message: str):
+            return await engine.send_message({
+                "chatId": user_id,
+                "sessionID": f"replay-{user_id}",
+                "message": message,
+            })
+        return run_turn
+
+    if name == "mainasync":
+        import mainasync as engine
+        engine.client_pool = pool
+
+        async def run_turn(user_id: str, message: str):
+            return await engine.send_message(user_id, uuid.uuid4().hex[:8], message)
+        return run_turn
+
+    raise ValueError(f'Unknown engine "{name}"')
+
+# ============================================================================
+# SECTION 4: REPLAY
+# ============================================================================
+
+async def replay_user(user_id: str, script: List[Dict], run_turn, speed: float,
+                      use_recorded_latency: bool, results: List[Dict]):
+    """
+    Replay one user's turns in order, keeping their think times (scaled by speed).
+    Only the mock upstream time is scaled back by speed; engine overhead (queueing,
+    sessions, logging...) is real time on both scales and is reported unscaled.
+    """
+    from mock_backend import LATENCY_HINT, UPSTREAM_SECONDS
+
+    for turn_index, turn in enumerate(script):
+        await asyncio.sleep(turn["delay"] / speed)
+
+        recorded = turn["recorded_latency"]
+        if use_recorded_latency:
+            LATENCY_HINT.set((recorded or 0.0) / speed)
+
+        upstream: List[float] = []
+        UPSTREAM_SECONDS.set(upstream)
+        started = time.perf_counter()
+        error = None
+        try:
+            await run_turn(user_id, turn["message"])
+        except Exception as err:
+            error = str(err)
+        elapsed = time.perf_counter() - started
+        upstream_seconds = min(sum(upstream), elapsed)
+
+        results.append({
+            "user_id": user_id,
+            "turn": turn_index,
+            "correlation_id": turn["correlation_id"],
+            "recorded_latency": recorded,
+            # Upstream time back on the recorded time scale, engine overhead as measured
+            "replayed_latency": upstream_seconds * speed + (elapsed - upstream_seconds),
+            "overhead": elapsed - upstream_seconds,
+            "error": error,
+        })
+
+async def replay(events: List[Dict], speed: float = 1.0, engine: str = "chatbot",
+                 latency: Optional[float] = None) -> List[Dict]:
+    """Replay a recorded timeline and return one result row per request"""
+    if speed <= 0:
+        raise ValueError("speed must be positive")
+
+    scripts = build_user_scripts(events)
+    run_turn = make_engine(engine, latency)
+    results: List[Dict] = []
+
+    print(f"▶️ Replaying {sum(len(s) for s in scripts.values())} requests "
+          f"from {len(scripts)} users at {speed}x against '{engine}'")
+
+    await asyncio.gather(*[
+        replay_user(user_id, script, run_turn, speed, latency is None, results)
+        for user_id, script in scripts.items()
+    ])
+    return results
+
+# ============================================================================
+# SECTION 5: REPORT
+# ============================================================================
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(results: List[Dict]) -> Dict[str, Any]:
+    paired = [r for r in results if r["recorded_latency"] is not None and not r["error"]]
+    recorded = [r["recorded_latency"] for r in paired]
+    replayed = [r["replayed_latency"] for r in paired]
+    deltas = [r["replayed_latency"] - r["recorded_latency"] for r in paired]
+    overheads = [r["overhead"] for r in results if not r["error"]]
+
+    summary = {"requests": len(results), "errors": sum(1 for r in results if r["error"])}
+    for label, values in (("recorded", recorded), ("replayed", replayed), ("delta", deltas),
+                          ("overhead", overheads)):
+        summary[label] = {
+            "mean": sum(values) / len(values) if values else float("nan"),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values) if values else float("nan"),
+        }
+    return summary
+
+def print_report(results: List[Dict]):
+    print("\n📊 REPLAY LATENCY (seconds, recorded time scale)\n")
+    print(f"{'User':<8}{'ClientCorrID':<14}{'Recorded':>10}{'Replayed':>10}{'Delta':>10}{'Overhead':>10}")
+    print("-" * 62)
+    for r in sorted(results, key=lambda r: (r["user_id"], r["turn"])):
+        recorded = r["recorded_latency"]
+        recorded_str = f"{recorded:.3f}" if recorded is not None else "-"
+        delta_str = f"{r['replayed_latency'] - recorded:+.3f}" if recorded is not None else "-"
+        suffix = f"  ❌ {r['error']}" if r["error"] else ""
+        print(f"{r['user_id']:<8}{r['correlation_id']:<14}{recorded_str:>10}"
+              f"{r['replayed_latency']:>10.3f}{delta_str:>10}{r['overhead']:>10.3f}{suffix}")
+
+    summary = summarize(results)
+    print(f"\n📈 Requests: {summary['requests']} | Errors: {summary['errors']}")
+    for label in ("recorded", "replayed", "delta", "overhead"):
+        stats = summary[label]
+        print(f"   {label:<9} mean {stats['mean']:+.3f}  p50 {stats['p50']:+.3f}  "
+              f"p95 {stats['p95']:+.3f}  max {stats['max']:+.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded chat timeline against the mock backend")
+    parser.add_argument("log", help="Timeline log (JSON, JSONL or streaming JSON)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier (default 1x)")
+    parser.add_argument("--engine", choices=["chatbot", "mainasync"], default="chatbot")
+    parser.add_argument("--latency", type=float, default=None,
+                        help="Fixed mock latency in seconds (default: recorded latency / speed)")
+    parser.add_argument("--output", help="Write per-request results to this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(replay(load_timeline(args.log), args.speed, args.engine, args.latency))
+    flush_logs()  # Queued engine logs first, then the report
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summarize(results), "results": results}, f, indent=2)
+        print(f"\n📁 Saved replay results to: {args.output}")
+
+if __name__ == "__main__":
+    main()
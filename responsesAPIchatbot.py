@@ -6,13 +6,30 @@ A generic template for building multi-user chatbots with custom tools and sessio
 import os
 import asyncio
 import time
-import json
+import logging
 from typing import Dict, List, Optional, Any
-from openai import OpenAI
 from dotenv import load_dotenv
+from scheduler import FairScheduler, estimate_request_cost, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from client_pool import ClientPool, ChainUnavailable
+from tool_results import compact_tool_result, describe_compaction
+from admission import AdmissionController, OverloadedError, REJECT, DEGRADE
+from memory_index import MemoryStore, pool_embedder, EMBEDDING_MODEL
+from search_index import SearchIndex, SEARCH_DB_PATH
+from loop_monitor import install_loop_monitor
+from usage_tracker import UsageTracker, STAGE_MAIN, STAGE_TOOL, STAGE_RESET, STAGE_EMBEDDING
+from session_snapshot import open_store, snapshot_periodically
+from conversation_state import (CONVERSATION_MODE, MODE_STATELESS, append_turn, build_input, message_item,
+                                stateless_payload, turns_from_history)
+from log_pipeline import (get_logger, log_context, new_correlation_id, current_correlation_id,
+                          current_chat_id, flush_logs)
+import runtime
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# One or more API keys / endpoints (see client_pool.py for OPENAI_API_KEYS / OPENAI_POOL_CONFIG)
+client_pool = ClientPool.from_env()
+
+# Request logs go through a background writer with chat_id / correlation_id fields (see log_pipeline.py)
+log = get_logger("responsesAPIchatbot")
 
 # Import your session manager module (assumed to exist)
 # from session_manager import get_or_create_session, update_session
@@ -21,31 +38,69 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 # SECTION 1: CONFIGURATION
 # ============================================================================
 
-CONTEXT_PAIRS_LIMIT = 6  # Create new session every N message pairs
+CONTEXT_PAIRS_LIMIT = 6  # Create new session every N message pairs (chained mode)
 MAX_TOKENS = 4000
 
+# CONVERSATION_MODE (imported above): "chained" = previous_response_id + periodic session reset,
+# "stateless" = store=false with the compact turn list kept in the session (see conversation_state.py)
+
 # Active user sessions tracking for concurrent handling
 active_user_sessions = {}  # chat_id -> { last_request_time, is_processing }
 
+# Upstream concurrency cap shared fairly across chat_ids (see scheduler.py)
+MAX_CONCURRENT_UPSTREAM = int(os.getenv("MAX_CONCURRENT_UPSTREAM", "16"))
+scheduler = FairScheduler(max_concurrent=MAX_CONCURRENT_UPSTREAM)
+
+# Admission control: reject / defer / degrade early when the latency SLO is at risk (see admission.py)
+admission = AdmissionController(queue_depth_fn=scheduler.queued_count)
+DEGRADED_REPLY = "We're handling a lot of requests right now. Please try again in a moment."
+
+# Token usage / prompt-cache accounting for every model call (see usage_tracker.py)
+usage_tracker = UsageTracker()
+
+# Long-term memory (opt-in, LONG_TERM_MEMORY=1): on a context reset, inject the MEMORY_TOP_K most
+# relevant past turns instead of the raw recent history (see memory_index.py). Costs one embeddings
+# call per turn. MEMORY_DIR memory-maps one file per chat.
+MEMORY_TOP_K = 4
+
+async def embed_texts(texts: List[str]):
+    """Embeddings through the current client pool, under the same upstream cap as model calls"""
+    chat_id = current_chat_id() or "memory"
+    cost = estimate_request_cost({"input": "\n".join(texts)})
+
+    def record(response, latency: float):
+        usage_tracker.record(response, chat_id, STAGE_EMBEDDING, EMBEDDING_MODEL, latency, current_correlation_id())
+
+    async with scheduler.slot(chat_id, priority=PRIORITY_BACKGROUND, cost=cost):
+        return await pool_embedder(client_pool, on_response=record)(texts)
+
+LONG_TERM_MEMORY_ENABLED = os.getenv("LONG_TERM_MEMORY", "0") == "1"
+memory_store = MemoryStore(embed_texts, directory=os.getenv("MEMORY_DIR"))
+background_tasks = set()  # Keeps fire-and-forget tasks alive until they finish
+
 # ============================================================================
 # SECTION 2: CUSTOM TOOL DEFINITIONS
 # ============================================================================
 
 # Define your custom tools here
 # Each tool should return: { "success": bool, "data": Any, "message": str }
+# Reference search backend: SQLite FTS5 behind a bounded connection pool (see search_index.py)
+search_index = SearchIndex(SEARCH_DB_PATH)
+
 async def search_database(query: str, chat_id: str) -> Dict:
     """Example tool 1: Search database"""
     try:
         # Your custom tool implementation
-        # results = await your_search_function(query)
-        results = []
+        page = await search_index.search(query)
+        results = page["results"]
+        more = " (more available)" if page["next_page"] else ""
         return {
             "success": True,
             "data": results,
-            "message": f"Found {len(results)} results"
+            "message": f"Found {len(results)} results{more}"
         }
     except Exception as error:
-        print(f"❌ [ChatID: {chat_id}] Error in search_database: {str(error)}")
+        log.error(f"❌ [ChatID: {chat_id}] Error in search_database: {str(error)}")
         return {
             "success": False,
             "data": None,
@@ -64,7 +119,7 @@ async def process_data(data: Any, chat_id: str) -> Dict:
             "message": "Data processed successfully"
         }
     except Exception as error:
-        print(f"❌ [ChatID: {chat_id}] Error in process_data: {str(error)}")
+        log.error(f"❌ [ChatID: {chat_id}] Error in process_data: {str(error)}")
         return {
             "success": False,
             "data": None,
@@ -79,6 +134,14 @@ available_tools = {
     # Add more tools as needed...
 }
 
+# Per-tool limits applied before results are sent back to the model (see tool_results.py)
+# fields: keep only these keys per row | max_rows + rank_by: top-k rows
+# max_bytes / max_tokens: hard cap on the serialized result
+TOOL_RESULT_LIMITS = {
+    "searchDatabase": {"fields": ["title", "snippet", "score"], "max_rows": 20, "rank_by": "score", "max_tokens": 2000},
+    "processData": {"max_bytes": 8000},
+}
+
 # ============================================================================
 # SECTION 3: SYSTEM PROMPT & CONTEXT MANAGEMENT
 # ============================================================================
@@ -153,20 +216,38 @@ async def execute_tool_from_command(tool_command: str, current_message: str, cha
             "message": f'Tool "{tool_name}" is not available'
         }
 
-    print(f"🛠️ [ChatID: {chat_id}] Executing tool: {tool_name} with parameters: '{parameters}'")
+    log.info(f"🛠️ [ChatID: {chat_id}] Executing tool: {tool_name} with parameters: '{parameters}'")
     
     try:
         result = await tool_func(parameters, chat_id)
-        print(f"✅ [ChatID: {chat_id}] Tool {tool_name} completed: {result.get('message', '')}")
+        log.info(f"✅ [ChatID: {chat_id}] Tool {tool_name} completed: {result.get('message', '')}")
         return result
     except Exception as error:
-        print(f"❌ [ChatID: {chat_id}] Tool {tool_name} error: {str(error)}")
+        log.error(f"❌ [ChatID: {chat_id}] Tool {tool_name} error: {str(error)}")
         return {
             "success": False,
             "data": None,
             "message": f"Tool execution failed: {str(error)}"
         }
 
+async def call_openai(payload: Dict, chat_id: str, priority: str = PRIORITY_INTERACTIVE,
+                      stage: str = STAGE_MAIN, owner: Optional[str] = None):
+    """
+    Run one Responses API call once the scheduler grants this chat an upstream slot.
+    owner: endpoint that created previous_response_id. Raises ChainUnavailable when the
+    chain can't be continued (the caller starts a new session).
+    """
+    async with scheduler.slot(chat_id, priority=priority, cost=estimate_request_cost(payload)):
+        # The pool picks the endpoint (chains stay on the key that created them)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        response = await client_pool.create(payload, owner=owner)
+
+    # Tokens (incl. cached input) and upstream latency per chat / stage / model
+    usage_tracker.record(response, chat_id, stage, payload.get("model"), loop.time() - started,
+                         current_correlation_id())
+    return response
+
 def extract_response_text(response) -> str:
     """Extract text from OpenAI Responses API output"""
     if not hasattr(response, 'output') or not isinstance(response.output, list):
@@ -211,15 +292,86 @@ def get_recent_messages_with_current(chat_history: List[Dict], current_user_mess
     
     return messages_with_current
 
+def chain_fields(response_id: Optional[str]) -> Dict:
+    """Session fields for a chain: the response id and the endpoint (key) that holds it"""
+    return {"chatSessionID": response_id, "chatEndpoint": client_pool.owner_of(response_id)}
+
+def restart_chain_payload(payload: Dict, system_prompt: str, chat_history: List[Dict], message: str) -> Dict:
+    """Same call as a new session: no previous_response_id, the recent raw history goes in the input"""
+    recent = [
+        msg for msg in chat_history
+        if msg.get("role") in ["user", "assistant"] and (msg.get("message") or "").strip()
+    ][-(2 * (CONTEXT_PAIRS_LIMIT - 1)):]
+
+    new_payload = {k: v for k, v in payload.items() if k != "previous_response_id"}
+    new_payload["input"] = [
+        {
+            "type": "message",
+            "role": "developer",
+            "content": system_prompt + "\n\nCONTEXT: Continuing from recent conversation."
+        },
+        *[{"type": "message", "role": msg["role"], "content": msg["message"]} for msg in recent],
+        {"type": "message", "role": "user", "content": message}
+    ]
+    return new_payload
+
+async def recall_relevant_messages(chat_id: str, current_user_message: str, current_ai_response: str) -> List[Dict]:
+    """Most relevant past turns from long-term memory plus the current pair (empty if nothing stored)"""
+    if not LONG_TERM_MEMORY_ENABLED:
+        return []
+    try:
+        recalled = await memory_store.recall(chat_id, current_user_message, MEMORY_TOP_K)
+    except Exception as error:
+        log.warning(f"❌ [ChatID: {chat_id}] Memory recall failed, using recent history: {str(error)}")
+        return []
+    if not recalled:
+        return []
+    return [
+        *recalled,
+        {"role": "user", "message": current_user_message},
+        {"role": "assistant", "message": current_ai_response}
+    ]
+
+async def remember_turn(chat_id: str, user_message: str, ai_response: str):
+    """Store the finished turn in long-term memory (runs off the request path)"""
+    try:
+        await memory_store.remember_turn(chat_id, user_message, ai_response)
+    except Exception as error:
+        log.error(f"❌ [ChatID: {chat_id}] Failed to store turn in memory: {str(error)}")
+
+# In-process stand-in for session_manager: chat_id -> session. With SESSION_SNAPSHOT_DIR set it is
+# snapshotted incrementally and restored lazily on restart (see session_snapshot.py)
+session_store = open_store("sessions")
+
+async def get_or_create_session(chat_id: str, session_id: str) -> Dict:
+    """Helper to load (or start) a user's session"""
+    # Assuming session_manager has this functionality
+    # return await session_manager.get_or_create_session(chat_id, session_id)
+    session = session_store.get(chat_id)
+    if session is None:
+        session = session_store[chat_id] = {
+            "sessionID": session_id,
+            "sessionLengthCounter": 0,
+            "chatSessionID": None,
+            "chatEndpoint": None,  # Endpoint owning chatSessionID, so a restored chain finds its key
+            "conversationMode": CONVERSATION_MODE,  # Mode the chain / turns below were built in
+            "customContext": {},
+            "interactionHistory": [],
+            "chatHistory": [],
+            "turns": []  # Compact turn list (stateless mode)
+        }
+    return session
+
 async def update_session_fields(chat_id: str, update_data: Dict) -> Dict:
     """Helper to update session in database"""
     try:
         # Assuming session_manager has update functionality
         # return await session_manager.update_session(chat_id, update_data)
-        # For now, return dummy data
+        session_store.setdefault(chat_id, {}).update(update_data)
+        session_store.mark_dirty(chat_id)  # In-place change: include it in the next snapshot
         return {"success": True, "updated": update_data}
     except Exception as error:
-        print(f"❌ [ChatID: {chat_id}] Error updating session: {str(error)}")
+        log.error(f"❌ [ChatID: {chat_id}] Error updating session: {str(error)}")
         raise error
 
 # ============================================================================
@@ -231,6 +383,7 @@ async def process_message_for_user(params: Dict) -> str:
     message = params.get("message", "")
     session_id = params.get("sessionID", "")
     chat_id = params.get("chatId", "")
+    priority = params.get("priority", PRIORITY_INTERACTIVE)
     
     try:
         # 1. Mark user as processing (prevents duplicate concurrent requests for same user)
@@ -239,23 +392,29 @@ async def process_message_for_user(params: Dict) -> str:
             "last_request_time": time.time()
         }
 
-        print(f"🎯 STARTING REQUEST [ChatID: {chat_id}]")
-        print(f"💬 User Message: '{message[:100]}{'...' if len(message) > 100 else ''}'")
+        log.info(f"🎯 STARTING REQUEST [ChatID: {chat_id}]")
+        log.debug(f"💬 User Message: '{message[:100]}{'...' if len(message) > 100 else ''}'")
 
         # 2. Retrieve user session (memory isolation by chat_id)
-        # session = await get_or_create_session(chat_id, session_id)
-        # For demo, create a mock session
-        session = {
-            "sessionLengthCounter": 0,
-            "chatSessionID": None,
-            "customContext": {},
-            "interactionHistory": [],
-            "chatHistory": []
-        }
-        
+        session = await get_or_create_session(chat_id, session_id)
+
         current_counter = session.get("sessionLengthCounter", 0)
-        reset_after_this_response = should_reset_after_this_response(current_counter)
         previous_response_id = session.get("chatSessionID")
+        chain_owner = session.get("chatEndpoint")
+
+        # Stateless mode: the context is this chat's local turn list, not a server-side chain
+        stateless = CONVERSATION_MODE == MODE_STATELESS
+        turns = session.get("turns") or []
+        # The deployment switched modes since this chat's last turn: the chain or turn list
+        # left from the old mode is stale, rebuild the context from the raw history instead
+        mode_changed = session.get("conversationMode") not in (None, CONVERSATION_MODE)
+        restart_chain = mode_changed and not stateless
+        if restart_chain:
+            log.info(f"🔀 [ChatID: {chat_id}] Conversation mode changed to {CONVERSATION_MODE}, starting a new session")
+            previous_response_id, chain_owner, current_counter = None, None, 0
+        if stateless and (mode_changed or not turns):  # e.g. first turn after switching from chained mode
+            turns = turns_from_history(session.get("chatHistory", []))
+        reset_after_this_response = should_reset_after_this_response(current_counter)
 
         # 3. Create enhanced prompt with session context
         enhanced_system_prompt = create_enhanced_system_prompt(
@@ -276,6 +435,9 @@ async def process_message_for_user(params: Dict) -> str:
                 "content": message
             }
         ]
+        if stateless:
+            # Stable prefix (system prompt + past turns) first, so the prompt cache can reuse it
+            input_messages = build_input(enhanced_system_prompt, turns, [message_item("user", message)])
 
         # 5. Prepare payload for OpenAI Responses API
         openai_payload = {
@@ -284,16 +446,30 @@ async def process_message_for_user(params: Dict) -> str:
             "max_output_tokens": MAX_TOKENS
         }
         
-        if previous_response_id:
+        if stateless:
+            stateless_payload(openai_payload)  # store=false: any endpoint can serve the next turn
+        elif previous_response_id:
             openai_payload["previous_response_id"] = previous_response_id
+        elif restart_chain:
+            openai_payload = restart_chain_payload(openai_payload, enhanced_system_prompt,
+                                                   session.get("chatHistory", []), message)
 
-        print(f"📤 [ChatID: {chat_id}] Calling OpenAI API...")
+        log.debug(f"📤 [ChatID: {chat_id}] Calling OpenAI API...")
         
         # KEY POINT 1: Use asyncio.to_thread for non-blocking OpenAI calls
         # This allows multiple users to have concurrent API calls
-        response = await asyncio.to_thread(client.responses.create, **openai_payload)
+        # The scheduler decides which chat gets the next free upstream slot
+        try:
+            response = await call_openai(openai_payload, chat_id, priority, owner=chain_owner)
+        except ChainUnavailable as error:
+            # Chain's endpoint unknown / down or the response expired: new session from recent history
+            log.warning(f"🔗 [ChatID: {chat_id}] {str(error)}, starting a new session")
+            openai_payload = restart_chain_payload(openai_payload, enhanced_system_prompt,
+                                                   session.get("chatHistory", []), message)
+            current_counter, reset_after_this_response = 0, False
+            response = await call_openai(openai_payload, chat_id, priority)
         
-        print(f"✅ [ChatID: {chat_id}] OpenAI API call successful")
+        log.debug(f"✅ [ChatID: {chat_id}] OpenAI API call successful")
         
         new_response_id = response.id
         ai_text = extract_response_text(response)
@@ -305,7 +481,7 @@ async def process_message_for_user(params: Dict) -> str:
 
         # 6. Check for tool calls
         if 'TOOL_CALL:' in ai_text:
-            print(f"🔧 [ChatID: {chat_id}] AI requested tool call")
+            log.info(f"🔧 [ChatID: {chat_id}] AI requested tool call")
             
             import re
             tool_call_match = re.search(r'TOOL_CALL:[^\n]+', ai_text)
@@ -317,6 +493,14 @@ async def process_message_for_user(params: Dict) -> str:
             if tool_result and tool_result.get("success"):
                 # 7. Let AI process tool results (maintains conversational flow)
                 tool_name = tool_command.split(':')[1]
+
+                # Compact + cap the result so large outputs don't bloat the follow-up prompt
+                tool_result_text, compaction = compact_tool_result(
+                    tool_result.get('data', {}),
+                    TOOL_RESULT_LIMITS.get(tool_name),
+                    measure=log.isEnabledFor(logging.DEBUG)  # Size before compaction costs a full encode
+                )
+                log.debug(f"📦 [ChatID: {chat_id}] Tool {tool_name} result: {describe_compaction(compaction)}")
                 
                 processing_input = [
                     {
@@ -340,7 +524,7 @@ Now provide a helpful response to the user based on these results."""
                     {
                         "type": "message",
                         "role": "user",
-                        "content": f"""Tool Results: {json.dumps(tool_result.get('data', {}), indent=2)}
+                        "content": f"""Tool Results: {tool_result_text}
 
 Based on these results, provide a helpful response to my original message."""
                     }
@@ -352,31 +536,47 @@ Based on these results, provide a helpful response to my original message."""
                     "previous_response_id": new_response_id,
                     "max_output_tokens": MAX_TOKENS
                 }
+                if stateless:
+                    # Same prefix as the first call; the tool exchange goes after it
+                    tool_processing_payload["input"] = build_input(enhanced_system_prompt, turns, processing_input[1:])
+                    stateless_payload(tool_processing_payload)
 
                 # Process tool results through AI
-                processed_response = await asyncio.to_thread(
-                    client.responses.create, 
-                    **tool_processing_payload
-                )
+                try:
+                    processed_response = await call_openai(tool_processing_payload, chat_id, priority, STAGE_TOOL,
+                                                           owner=client_pool.owner_of(new_response_id))
+                except ChainUnavailable as error:
+                    # processing_input carries the message, tool call and results: send it unchained
+                    log.warning(f"🔗 [ChatID: {chat_id}] {str(error)}, sending tool results without the chain")
+                    tool_processing_payload.pop("previous_response_id", None)
+                    processed_response = await call_openai(tool_processing_payload, chat_id, priority, STAGE_TOOL)
                 final_response = extract_response_text(processed_response) or tool_result.get("message", "")
                 
                 # Update with new response ID from tool processing
-                await update_session_fields(chat_id, {
-                    "chatSessionID": processed_response.id
-                })
+                if not stateless:
+                    await update_session_fields(chat_id, chain_fields(processed_response.id))
             else:
                 final_response = "I encountered an error while processing your request. Please try again."
 
         # 8. Handle session counter and context reset
-        if reset_after_this_response:
-            print(f"🔄 [ChatID: {chat_id}] Creating new session (context reset)")
+        if stateless:
+            # Nothing to reset server-side: append the turn, trimming the oldest ones in blocks
+            turns, dropped = append_turn(turns, message, final_response)
+            await update_session_fields(chat_id, {"turns": turns})
+            if dropped:
+                log.info(f"✂️ [ChatID: {chat_id}] Trimmed {dropped} old turns, {len(turns)} kept")
+        elif reset_after_this_response:
+            log.info(f"🔄 [ChatID: {chat_id}] Creating new session (context reset)")
             
-            # Get recent messages for new session
-            recent_messages = get_recent_messages_with_current(
-                session.get("chatHistory", []),
-                message,
-                final_response
-            )
+            # Get the most relevant past turns for the new session,
+            # falling back to the raw recent history when memory is empty
+            recent_messages = await recall_relevant_messages(chat_id, message, final_response)
+            if not recent_messages:
+                recent_messages = get_recent_messages_with_current(
+                    session.get("chatHistory", []),
+                    message,
+                    final_response
+                )
 
             valid_messages = [
                 msg for msg in recent_messages 
@@ -409,33 +609,47 @@ Based on these results, provide a helpful response to my original message."""
                 "max_output_tokens": MAX_TOKENS
             }
 
-            # Create new session (no previous_response_id)
-            new_session_response = await asyncio.to_thread(
-                client.responses.create, 
-                **reset_payload
-            )
+            # Create new session (no previous_response_id). The reply is already written, so the
+            # reset yields to waiting user turns (PRIORITY_BACKGROUND, see scheduler.py)
+            new_session_response = await call_openai(reset_payload, chat_id, PRIORITY_BACKGROUND, STAGE_RESET)
             new_session_id = new_session_response.id
 
             # Save new session ID and reset counter
             await update_session_fields(chat_id, {
-                "chatSessionID": new_session_id,
+                **chain_fields(new_session_id),
                 "sessionLengthCounter": 0
             })
 
-            print(f"✅ [ChatID: {chat_id}] New session created with ID: {new_session_id}")
+            log.info(f"✅ [ChatID: {chat_id}] New session created with ID: {new_session_id}")
         else:
             # Normal flow - increment counter and save response ID
             new_counter = current_counter + 1
             await update_session_fields(chat_id, {
                 "sessionLengthCounter": new_counter,
-                "chatSessionID": new_response_id  # Save response ID for next call
+                **chain_fields(new_response_id)  # Save response ID (and its endpoint) for next call
             })
 
-        print(f"🏁 COMPLETED REQUEST [ChatID: {chat_id}]")
+        # 9. Keep the last CONTEXT_PAIRS_LIMIT pairs of raw history in the session
+        await update_session_fields(chat_id, {
+            "conversationMode": CONVERSATION_MODE,
+            "chatHistory": [
+                *session.get("chatHistory", []),
+                {"role": "user", "message": message},
+                {"role": "assistant", "message": final_response}
+            ][-(2 * CONTEXT_PAIRS_LIMIT):]
+        })
+
+        # 10. Index this turn for future recalls without delaying the reply
+        if LONG_TERM_MEMORY_ENABLED:
+            memory_task = asyncio.create_task(remember_turn(chat_id, message, final_response))
+            background_tasks.add(memory_task)
+            memory_task.add_done_callback(background_tasks.discard)
+
+        log.info(f"🏁 COMPLETED REQUEST [ChatID: {chat_id}]")
         return final_response
 
     except Exception as err:
-        print(f"❌ [ChatID: {chat_id}] Error: {str(err)}")
+        log.error(f"❌ [ChatID: {chat_id}] Error: {str(err)}")
         raise err
     finally:
         # Clean up active session
@@ -446,35 +660,56 @@ Based on these results, provide a helpful response to my original message."""
 # SECTION 7: MULTI-USER CONCURRENT HANDLING
 # ============================================================================
 
+async def admitted_process(params: Dict) -> str:
+    """Run process_message_for_user behind admission control"""
+    chat_id = params.get("chatId")
+    correlation_id = params.get("correlationId") or current_correlation_id() or new_correlation_id()
+
+    # Every log line of this request carries its chat_id / correlation_id
+    with log_context(chat_id=chat_id, correlation_id=correlation_id):
+        decision = await admission.decide(params.get("priority", PRIORITY_INTERACTIVE))
+
+        if decision == REJECT:
+            retry_after = admission.retry_after()
+            log.warning(f"🚦 [ChatID: {chat_id}] Rejected by admission control (retry in {retry_after}s)")
+            raise OverloadedError("The service is busy.", retry_after)
+        if decision == DEGRADE:
+            log.warning(f"🚦 [ChatID: {chat_id}] Degraded reply (latency SLO at risk)")
+            return DEGRADED_REPLY
+
+        async with admission.track():
+            return await process_message_for_user(params)
+
 async def send_message(params: Dict) -> str:
     """Main entry point for single user requests"""
-    try:
-        chat_id = params.get("chatId")
-        
-        # Prevent multiple concurrent requests from same user
-        active_session = active_user_sessions.get(chat_id)
-        if active_session and active_session.get("is_processing"):
-            raise Exception("Please wait for your previous request to complete.")
+    chat_id = params.get("chatId")
 
-        print(f"👥 Processing request for [ChatID: {chat_id}]")
-        
-        # Process this user's message
-        result = await process_message_for_user(params)
-        
-        print(f"✅ [ChatID: {chat_id}] Request completed")
-        return result
+    with log_context(chat_id=chat_id, correlation_id=params.get("correlationId") or new_correlation_id()):
+        try:
+            # Prevent multiple concurrent requests from same user
+            active_session = active_user_sessions.get(chat_id)
+            if active_session and active_session.get("is_processing"):
+                raise Exception("Please wait for your previous request to complete.")
 
-    except Exception as err:
-        print(f"❌ Global error: {str(err)}")
-        raise err
+            log.debug(f"👥 Processing request for [ChatID: {chat_id}]")
+            
+            # Process this user's message (admission control may reject or degrade it)
+            result = await admitted_process(params)
+            
+            log.debug(f"✅ [ChatID: {chat_id}] Request completed")
+            return result
+
+        except Exception as err:
+            log.error(f"❌ Global error: {str(err)}")
+            raise err
 
 # KEY POINT 2: Handle multiple users concurrently
 async def process_multiple_users(user_requests: List[Dict]) -> List[str]:
     """Process multiple users concurrently"""
-    print(f"👥 Processing {len(user_requests)} users concurrently...")
+    log.info(f"👥 Processing {len(user_requests)} users concurrently...")
     
     # Create independent tasks for all users
-    tasks = [process_message_for_user(params) for params in user_requests]
+    tasks = [admitted_process(params) for params in user_requests]
     
     # KEY POINT: asyncio.gather sends all requests in parallel
     # Each user's request runs independently without blocking others
@@ -484,12 +719,12 @@ async def process_multiple_users(user_requests: List[Dict]) -> List[str]:
     final_results = []
     for i, result in enumerate(results):
         if isinstance(result, Exception):
-            print(f"❌ User {i} failed: {str(result)}")
+            log.error(f"❌ User {i} failed: {str(result)}")
             final_results.append(f"Error: {str(result)}")
         else:
             final_results.append(result)
     
-    print(f"✅ All {len(user_requests)} users processed concurrently")
+    log.info(f"✅ All {len(user_requests)} users processed concurrently")
     return final_results
 
 # ============================================================================
@@ -500,6 +735,14 @@ def get_active_user_count() -> int:
     """Get number of active users"""
     return len(active_user_sessions)
 
+def get_admission_metrics() -> Dict:
+    """Admission decisions, in-flight count, queue depth and recent p95 vs SLO"""
+    return admission.metrics()
+
+def get_usage_report() -> Dict:
+    """Tokens, cache-hit ratio and tokens/sec per stage / model, heaviest chats"""
+    return usage_tracker.report()
+
 async def cleanup_inactive_sessions():
     """Clean up inactive sessions periodically"""
     while True:
@@ -514,7 +757,7 @@ async def cleanup_inactive_sessions():
         
         for chat_id in inactive_users:
             del active_user_sessions[chat_id]
-            print(f"🧹 Cleaned up inactive session for ChatID: {chat_id}")
+            log.info(f"🧹 Cleaned up inactive session for ChatID: {chat_id}")
 
 # ============================================================================
 # SECTION 9: DEMO & TESTING
@@ -542,22 +785,37 @@ async def demo_concurrent_users():
     
     # Start cleanup task
     cleanup_task = asyncio.create_task(cleanup_inactive_sessions())
+
+    # Periodic session snapshots (final one on shutdown) when SESSION_SNAPSHOT_DIR is set
+    snapshot_task = asyncio.create_task(snapshot_periodically(session_store)) if session_store.path else None
+
+    # Event loop lag / slow-callback monitor (only when LOOP_MONITOR=1)
+    loop_monitor = install_loop_monitor()
     
     try:
         # Process users concurrently
         results = await process_multiple_users(user_requests)
         
+        flush_logs()  # Request logs first, then the summary
         print("\n📊 Results:")
         for i, result in enumerate(results):
             print(f"User {i+1}: {result[:100]}{'...' if len(result) > 100 else ''}")
+
+        print(f"\n🚦 Admission metrics: {get_admission_metrics()}")
+        usage_tracker.print_report()
             
     finally:
-        # Cancel cleanup task
-        cleanup_task.cancel()
-        try:
-            await cleanup_task
-        except asyncio.CancelledError:
-            pass
+        if loop_monitor:
+            loop_monitor.print_report()
+            await loop_monitor.stop()
+
+        # Cancel cleanup task (and the snapshot task, which writes a final snapshot)
+        for task in filter(None, (cleanup_task, snapshot_task)):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
 
 # ============================================================================
 # SECTION 10: HOW IT WORKS - PYTHON SPECIFIC
@@ -572,6 +830,46 @@ In Python (unlike Node.js), we need explicit threading for concurrent I/O operat
 3. Each user gets their own thread for API calls
 4. Threads complete and return to their respective async contexts
 
+KEY CONCEPT 1b: Fair Upstream Scheduling
+-----------------------------------------
+- Every model call goes through call_openai() -> scheduler.slot()
+- At most MAX_CONCURRENT_UPSTREAM calls are in flight at once
+- Free slots are shared fairly across chat_ids (weighted fair queuing)
+- Pass "priority": "background" in params for non-interactive traffic
+- Context reset calls always run at background priority, behind waiting user turns
+
+KEY CONCEPT 1c: Endpoint Pool
+-----------------------------
+- client_pool spreads calls over several API keys / base URLs by remaining rate budget
+- Endpoints with repeated errors are skipped until their circuit breaker cools down
+- previous_response_id chains are always sent to the endpoint that created them
+- Only 429 / 5xx / timeouts / connection errors count toward a breaker, not bad requests (4xx)
+- A chain whose endpoint is unknown or down raises ChainUnavailable: the turn starts a new session
+- The session stores the endpoint with the response id ("chatEndpoint"), so restored chains keep their key
+
+KEY CONCEPT 1d: Admission Control
+---------------------------------
+- send_message / process_multiple_users go through admitted_process()
+- Interactive work waits briefly for capacity, then is rejected with a retry hint (OverloadedError)
+- Background work gets DEGRADED_REPLY as soon as the latency SLO is at risk
+- get_admission_metrics() exposes the decisions
+
+KEY CONCEPT 1e: Token Usage Accounting
+--------------------------------------
+- call_openai() records response.usage with a stage: main, tool (follow-up) or reset;
+  memory embeddings are recorded under the embedding stage
+- Totals per chat_id, stage and model, with cache-hit ratio and tokens/sec
+- get_usage_report() / usage_tracker.export_json(path) for dashboards and cost checks
+
+KEY CONCEPT 1f: Chained vs Stateless Conversations
+--------------------------------------------------
+- CONVERSATION_MODE=chained (default): previous_response_id, new session every CONTEXT_PAIRS_LIMIT pairs
+- CONVERSATION_MODE=stateless: store=false, the session keeps a compact turn list ("turns")
+- Stateless input = system prompt + trimmed tail + new message (cache-friendly prefix, see conversation_state.py)
+- No server-side state, so no reset calls and no pinning of the chat to one endpoint
+- The session records its mode; after a switch the old chain / turn list is dropped and the
+  next turn is rebuilt from the recent raw history
+
 KEY CONCEPT 2: Memory Isolation by chat_id
 -------------------------------------------
 - Each user's session is identified by chat_id
@@ -597,8 +895,10 @@ KEY CONCEPT 5: Responses API Session Management
 - Uses OpenAI Responses API with previous_response_id
 - Creates new session every CONTEXT_PAIRS_LIMIT messages
 - Maintains conversation state across calls
+- With LONG_TERM_MEMORY=1, every finished turn is embedded into the chat's memory index (memory_index.py)
+  and a new session gets the MEMORY_TOP_K most relevant past turns, not the raw recent history
 """
 
 if __name__ == "__main__":
-    # Run demo
-    asyncio.run(demo_concurrent_users())
\ No newline at end of file
+    # Run demo (uvloop + sized executor when available, see runtime.py)
+    runtime.run(demo_concurrent_users())
\ No newline at end of file
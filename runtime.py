@@ -0,0 +1,181 @@
+"""
+runtime.py
+Runtime profile picked at startup for every entry point (instead of a bare asyncio.run):
+- Event loop: uvloop when installed (RUNTIME_LOOP=auto), or forced "uvloop" / "asyncio"
+- Default executor sized for the remaining asyncio.to_thread paths (sync OpenAI clients in
+  client_pool.py, embeddings, snapshot I/O) instead of Python's min(32, cpus + 4)
+- Benchmark of the default loop vs uvloop on the mock backend at 1k / 5k / 10k concurrent chats
+
+Usage:
+    python runtime.py bench --chats 1000 5000 10000 --turns 3 --engine chatbot pool
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Coroutine, Dict, List, Optional, Any
+
+try:
+    import uvloop  # Optional: libuv-based event loop, faster scheduling and I/O
+except ImportError:
+    uvloop = None
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+RUNTIME_LOOP = os.getenv("RUNTIME_LOOP", "auto")  # auto | uvloop | asyncio
+MAX_CONCURRENT_UPSTREAM = int(os.getenv("MAX_CONCURRENT_UPSTREAM", "16"))
+EXECUTOR_HEADROOM = 8  # Threads beyond the upstream cap for embeddings, snapshot writes...
+
+def executor_workers() -> int:
+    """EXECUTOR_WORKERS, else one thread per allowed upstream call plus headroom"""
+    configured = os.getenv("EXECUTOR_WORKERS")
+    if configured:
+        return int(configured)
+    return max(min(32, (os.cpu_count() or 1) + 4), MAX_CONCURRENT_UPSTREAM + EXECUTOR_HEADROOM)
+
+# ============================================================================
+# SECTION 2: RUNTIME PROFILE
+# ============================================================================
+
+def resolve_loop(name: str = RUNTIME_LOOP) -> str:
+    if name == "uvloop" and uvloop is None:
+        raise RuntimeError("RUNTIME_LOOP=uvloop but uvloop is not installed (pip install uvloop)")
+    if name == "auto":
+        return "uvloop" if uvloop is not None else "asyncio"
+    return name
+
+def new_event_loop(name: str = RUNTIME_LOOP) -> asyncio.AbstractEventLoop:
+    loop = uvloop.new_event_loop() if resolve_loop(name) == "uvloop" else asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=executor_workers(), thread_name_prefix="to-thread"))
+    return loop
+
+def run(main: Coroutine, loop_name: str = RUNTIME_LOOP, quiet: bool = False) -> Any:
+    """asyncio.run() with the runtime profile applied"""
+    name = resolve_loop(loop_name)
+    if not quiet:
+        print(f"⚙️ Runtime: {name} event loop, {executor_workers()} executor threads")
+    with asyncio.Runner(loop_factory=lambda: new_event_loop(name)) as runner:
+        return runner.run(main)
+
+def describe() -> Dict[str, Any]:
+    return {"loop": resolve_loop(), "uvloop_installed": uvloop is not None, "executor_workers": executor_workers()}
+
+# ============================================================================
+# SECTION 3: BENCHMARK (DEFAULT LOOP vs UVLOOP)
+# ============================================================================
+
+def bench_child(chats: int, turns: int, latency: float, loop_name: str, engine_name: str):
+    """
+    Runs in a fresh process: `chats` concurrent chats x `turns` turns on the asyncio-native mock
+    (latency awaited on the loop, no threads), so the loop is the shared resource being measured.
+    - chatbot: full responsesAPIchatbot.send_message (admission, scheduler, sessions)
+    - pool: scheduler slot + client_pool.create only, i.e. mostly event-loop work
+    Result goes to stdout as JSON.
+    """
+    import responsesAPIchatbot as engine
+    from mock_backend import mock_pool
+    from log_pipeline import flush_logs
+
+    engine.client_pool = mock_pool(latency=latency, asynchronous=True)
+    latencies: List[float] = []
+
+    async def turn_chatbot(index: int, turn: int, previous_id: Optional[str]) -> Optional[str]:
+        await engine.send_message({"chatId": f"c{index:05d}", "sessionID": f"bench-{index}",
+                                   "message": f"Message {turn} from chat {index}"})
+        return None
+
+    async def turn_pool(index: int, turn: int, previous_id: Optional[str]) -> Optional[str]:
+        payload = {"model": "gpt-4.1-mini", "input": f"Message {turn} from chat {index}"}
+        if previous_id:
+            payload["previous_response_id"] = previous_id
+        response = await engine.call_openai(payload, f"c{index:05d}")
+        return response.id
+
+    run_turn = turn_pool if engine_name == "pool" else turn_chatbot
+
+    async def chat(index: int):
+        loop = asyncio.get_running_loop()
+        previous_id = None
+        for turn in range(turns):
+            started = loop.time()
+            previous_id = await run_turn(index, turn, previous_id)
+            latencies.append(loop.time() - started)
+
+    async def main() -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*[chat(i) for i in range(chats)])
+        return time.perf_counter() - started
+
+    elapsed = run(main(), loop_name, quiet=True)
+    flush_logs()  # Queued engine logs first, so the JSON result stays the last stdout line
+    latencies.sort()
+    print(json.dumps({
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[int(len(latencies) * 0.99)],
+    }))
+
+def run_bench(chats: int, turns: int, latency: float, loop_name: str, engine_name: str) -> Dict[str, Any]:
+    from mock_backend import ensure_placeholder_credentials
+
+    ensure_placeholder_credentials()  # The child's engine builds ClientPool.from_env() on import
+    env = {
+        **os.environ,
+        "LOG_LEVEL": "WARNING", "LONG_TERM_MEMORY": "0",       # Measure the loop, not logging / embeddings
+        "MAX_CONCURRENT_UPSTREAM": str(chats),                  # No scheduler or admission queueing
+        "ADMISSION_MAX_IN_FLIGHT": str(chats), "ADMISSION_MAX_QUEUE_DEPTH": str(chats),
+    }
+    command = [sys.executable, os.path.abspath(__file__), "_child", "--chats", str(chats),
+               "--turns", str(turns), "--latency", str(latency), "--loop", loop_name, "--engine", engine_name]
+    child = subprocess.run(command, env=env, capture_output=True, text=True)
+    if child.returncode != 0:
+        raise RuntimeError(child.stderr)
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Runtime profile (uvloop + executor sizing)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("bench", help="Default asyncio loop vs uvloop on the mock backend")
+    bench.add_argument("--chats", type=int, nargs="+", default=[1000, 5000, 10000])
+    bench.add_argument("--turns", type=int, default=3)
+    bench.add_argument("--latency", type=float, default=0.2, help="Mock model latency (s)")
+    bench.add_argument("--engine", nargs="+", default=["chatbot", "pool"], choices=["chatbot", "pool"])
+
+    child = sub.add_parser("_child")
+    child.add_argument("--chats", type=int)
+    child.add_argument("--turns", type=int)
+    child.add_argument("--latency", type=float)
+    child.add_argument("--loop")
+    child.add_argument("--engine")
+
+    args = parser.parse_args()
+    if args.command == "_child":
+        bench_child(args.chats, args.turns, args.latency, args.loop, args.engine)
+        return
+
+    loops = ["asyncio"] + (["uvloop"] if uvloop is not None else [])
+    if uvloop is None:
+        print("⚠️ uvloop is not installed: only the default loop is measured")
+    print(f"⏱️ {args.turns} turns per chat, {args.latency}s mock latency")
+    for engine_name in args.engine:
+        for chats in args.chats:
+            baseline = None
+            for loop_name in loops:
+                result = run_bench(chats, args.turns, args.latency, loop_name, engine_name)
+                throughput = result["requests"] / result["seconds"]
+                baseline = baseline or throughput
+                print(f"   {engine_name:<7} {chats:>6} chats | {loop_name:<8} {throughput:>8.0f} req/s "
+                      f"({throughput / baseline:.2f}x) | {result['seconds']:.2f}s | "
+                      f"p50 {result['p50']:.3f}s p99 {result['p99']:.3f}s")
+
+if __name__ == "__main__":
+    main()
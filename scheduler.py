@@ -0,0 +1,243 @@
+"""
+scheduler.py
+Weighted fair scheduler that sits between the chat entry points and the model client.
+Caps concurrent upstream calls and shares the free slots fairly across chat_ids,
+so a few heavy chats cannot starve quick ones.
+"""
+
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple, Any
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+PRIORITY_INTERACTIVE = "interactive"  # A user is waiting on the reply
+PRIORITY_BACKGROUND = "background"    # Context resets, batch jobs, replays...
+
+# Share of dispatches each class gets while both have queued work
+DEFAULT_CLASS_WEIGHTS = {
+    PRIORITY_INTERACTIVE: 4,
+    PRIORITY_BACKGROUND: 1,
+}
+
+DEFAULT_MAX_CONCURRENT = 16  # Upstream calls allowed in flight at once
+CHARS_PER_COST_UNIT = 1000   # Request "cost" grows with prompt size...
+COST_PER_SLOT_SECOND = 1.0   # ...and with how long the chat's calls hold a slot (long outputs)
+LATENCY_EWMA_ALPHA = 0.3     # Weight of the newest observation in a chat's average slot time
+
+# ============================================================================
+# SECTION 2: COST ESTIMATION
+# ============================================================================
+
+def estimate_request_cost(payload: Dict) -> float:
+    """Rough cost of a model call, based on how much text it sends"""
+    input_data = payload.get("input", payload.get("messages", ""))
+    if isinstance(input_data, str):
+        chars = len(input_data)
+    else:
+        chars = sum(len(str(item.get("content", ""))) for item in input_data if isinstance(item, dict))
+    return 1.0 + chars / CHARS_PER_COST_UNIT
+
+# ============================================================================
+# SECTION 3: FAIR SCHEDULER
+# ============================================================================
+
+class FairScheduler:
+    """
+    Start-time fair queuing across chat_ids with weighted priority classes.
+
+    - Each chat_id is a flow. A request's start tag is
+      max(virtual_time, last finish tag of its flow), its finish tag adds cost / weight.
+      The queued request with the lowest start tag runs next, so chats that keep
+      sending long requests fall behind chats that send short ones.
+    - cost = prompt size (estimate_request_cost) + the chat's moving average of slot time.
+      When the call finishes, the finish tag is corrected to the time it really held the slot,
+      so a short prompt with a long answer (e.g. "500 words") is charged like the heavy call it was.
+    - A request cancelled while queued gives its charge back to its flow.
+    - Priority classes each have their own queue. Classes are picked by smooth
+      weighted round robin, so background work still progresses under load.
+    - At most max_concurrent requests hold a slot at any time.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 class_weights: Optional[Dict[str, int]] = None):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.max_concurrent = max_concurrent
+        self.class_weights = dict(class_weights or DEFAULT_CLASS_WEIGHTS)
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self.dispatched = 0
+
+        self._queues: Dict[str, List] = {name: [] for name in self.class_weights}
+        self._class_credit: Dict[str, int] = {name: 0 for name in self.class_weights}
+        self._flow_finish: Dict[str, float] = {}   # chat_id -> last finish tag
+        self._flow_weight: Dict[str, float] = {}   # chat_id -> weight (default 1)
+        self._flow_latency: Dict[str, float] = {}  # chat_id -> moving average of slot seconds
+        self._seq = itertools.count()
+
+    # ---- Flow configuration ----
+
+    def set_weight(self, chat_id: str, weight: float):
+        """Give a chat_id a larger (or smaller) share of the upstream slots"""
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self._flow_weight[chat_id] = weight
+
+    # ---- Acquire / release ----
+
+    @asynccontextmanager
+    async def slot(self, chat_id: str, priority: str = PRIORITY_INTERACTIVE, cost: float = 1.0):
+        """
+        Hold one upstream slot for the duration of the block:
+
+            async with scheduler.slot(chat_id, cost=estimate_request_cost(payload)):
+                response = await asyncio.to_thread(client.responses.create, **payload)
+        """
+        charge = await self._acquire(chat_id, priority, cost)
+        loop = asyncio.get_running_loop()
+        granted_at = loop.time()
+        try:
+            yield
+        finally:
+            self._settle(chat_id, cost, charge, loop.time() - granted_at)
+            self._release()
+
+    async def _acquire(self, chat_id: str, priority: str, cost: float) -> float:
+        """Wait for a slot; returns what was added to the flow's finish tag"""
+        if priority not in self._queues:
+            raise ValueError(f'Unknown priority class "{priority}"')
+
+        start_tag, charge = self._tag(chat_id, cost)
+
+        # Fast path: free slot and nobody waiting
+        if self.in_flight < self.max_concurrent and not self.queued_count():
+            self._grant(start_tag)
+            return charge
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [start_tag, next(self._seq), future]
+        heapq.heappush(self._queues[priority], entry)
+        self._dispatch()  # Slots may be free behind cancelled waiters
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted right as we got cancelled: hand it on
+                self._release()
+            else:
+                entry[2] = None  # Lazily dropped by _dispatch
+                self._adjust_finish(chat_id, -charge)  # Never ran: don't penalize the chat for it
+            raise
+        return charge
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _tag(self, chat_id: str, cost: float) -> Tuple[float, float]:
+        weight = self._flow_weight.get(chat_id, 1.0)
+        start_tag = max(self.virtual_time, self._flow_finish.get(chat_id, 0.0))
+        expected = cost + self._flow_latency.get(chat_id, 0.0) * COST_PER_SLOT_SECOND
+        charge = expected / weight
+        self._flow_finish[chat_id] = start_tag + charge
+        return start_tag, charge
+
+    def _adjust_finish(self, chat_id: str, delta: float):
+        if chat_id in self._flow_finish:  # Pruned flows have nothing left to adjust
+            self._flow_finish[chat_id] += delta
+
+    def _settle(self, chat_id: str, cost: float, charge: float, held_seconds: float):
+        """Replace the predicted slot time in the finish tag with the observed one"""
+        previous = self._flow_latency.get(chat_id)
+        self._flow_latency[chat_id] = held_seconds if previous is None else \
+            previous + LATENCY_EWMA_ALPHA * (held_seconds - previous)
+        actual = (cost + held_seconds * COST_PER_SLOT_SECOND) / self._flow_weight.get(chat_id, 1.0)
+        self._adjust_finish(chat_id, actual - charge)
+
+    def _grant(self, start_tag: float):
+        self.in_flight += 1
+        self.dispatched += 1
+        self.virtual_time = max(self.virtual_time, start_tag)
+        if len(self._flow_finish) > 4 * (self.max_concurrent + self.queued_count()) + 1024:
+            self._prune_flows()
+
+    def _prune_flows(self):
+        """Forget idle flows whose finish tag is already behind virtual time"""
+        stale = [cid for cid, finish in self._flow_finish.items() if finish <= self.virtual_time]
+        for chat_id in stale:
+            del self._flow_finish[chat_id]
+            self._flow_latency.pop(chat_id, None)
+
+    def _pick_class(self) -> Optional[str]:
+        """Smooth weighted round robin over the classes that have queued work"""
+        ready = [name for name, queue in self._queues.items() if queue]
+        if not ready:
+            return None
+        total = 0
+        for name in ready:
+            self._class_credit[name] += self.class_weights[name]
+            total += self.class_weights[name]
+        chosen = max(ready, key=lambda name: self._class_credit[name])
+        self._class_credit[chosen] -= total
+        return chosen
+
+    def _dispatch(self):
+        while self.in_flight < self.max_concurrent:
+            priority = self._pick_class()
+            if priority is None:
+                return
+            start_tag, _, future = heapq.heappop(self._queues[priority])
+            if future is None or future.done():
+                continue  # Waiter was cancelled while queued
+            self._grant(start_tag)
+            future.set_result(None)
+
+    # ---- Introspection ----
+
+    def queued_count(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "queued": {name: len(queue) for name, queue in self._queues.items()},
+            "dispatched": self.dispatched,
+            "tracked_flows": len(self._flow_finish),
+        }
+
+# ============================================================================
+# SECTION 4: DEMO
+# ============================================================================
+
+async def demo_fair_scheduling():
+    """Heavy chats vs quick chats through a 2-slot scheduler"""
+    import time
+
+    scheduler = FairScheduler(max_concurrent=2)
+    t0 = time.time()
+    finished = []
+
+    async def fake_call(chat_id: str, seconds: float, priority: str):
+        async with scheduler.slot(chat_id, priority=priority, cost=seconds * 10):
+            await asyncio.sleep(seconds)
+        finished.append((chat_id, round(time.time() - t0, 2)))
+
+    jobs = [fake_call("c3", 0.5, PRIORITY_INTERACTIVE) for _ in range(4)]
+    jobs += [fake_call("g7", 0.5, PRIORITY_BACKGROUND) for _ in range(4)]
+    jobs += [fake_call(f"quick{i}", 0.05, PRIORITY_INTERACTIVE) for i in range(4)]
+    await asyncio.gather(*jobs)
+
+    print("\n📊 Completion order (chat_id, seconds):")
+    for chat_id, elapsed in finished:
+        print(f"   {chat_id:<8}{elapsed}")
+    print(f"\n📈 Scheduler stats: {scheduler.stats()}")
+
+if __name__ == "__main__":
+    asyncio.run(demo_fair_scheduling())
@@ -0,0 +1,275 @@
+"""
+search_index.py
+Reference backend for the search_database tool: SQLite with an FTS5 full-text index.
+- Bounded connection pool: a fixed thread executor, one connection per worker thread
+- Prepared (cached) parameterized statements, bm25 ranking, result paging
+- Bulk ingest command and a concurrent-chats queries/sec benchmark
+
+Usage:
+    python search_index.py ingest search.db documents.jsonl      # {"title": ..., "body": ...} per line
+    python search_index.py bench search.db --chats 200 --queries 25 --synthetic 100000
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Any
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+SEARCH_DB_PATH = os.getenv("SEARCH_DB_PATH", "search.db")
+POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", "8"))  # Connections == executor threads
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+INGEST_BATCH_SIZE = 5000
+SNIPPET_TOKENS = 24
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    metadata TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    title, body, content='documents', content_rowid='id', tokenize='porter unicode61'
+);
+"""
+
+# Statements are constant strings so sqlite3's per-connection statement cache reuses them
+SEARCH_SQL = """
+SELECT d.id, d.title, snippet(documents_fts, 1, '[', ']', '…', ?) AS snippet,
+       d.metadata, -bm25(documents_fts, 2.0, 1.0) AS score
+FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+WHERE documents_fts MATCH ?
+ORDER BY bm25(documents_fts, 2.0, 1.0)
+LIMIT ? OFFSET ?
+"""
+COUNT_SQL = "SELECT count(*) FROM documents_fts WHERE documents_fts MATCH ?"
+INSERT_SQL = "INSERT INTO documents (title, body, metadata) VALUES (?, ?, ?)"
+
+# ============================================================================
+# SECTION 2: QUERY BUILDING
+# ============================================================================
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def build_match_query(text: str) -> Optional[str]:
+    """Free text -> safe FTS5 query: every word quoted (no operator injection), all words required"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"' for token in tokens[:32])
+
+# ============================================================================
+# SECTION 3: POOLED ASYNC INDEX
+# ============================================================================
+
+class SearchIndex:
+    """Async FTS5 search over a bounded pool of SQLite connections"""
+
+    def __init__(self, path: str = SEARCH_DB_PATH, pool_size: int = POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sqlite-search",
+                                            initializer=self._open_connection)
+        self._schema_ready = False
+
+    def _open_connection(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.row_factory = sqlite3.Row
+        self._local.connection = connection
+
+    def _connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "connection"):
+            self._open_connection()
+        return self._local.connection
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # ---- Schema & ingest (blocking, run inside the executor) ----
+
+    def _ensure_schema(self):
+        if not self._schema_ready:
+            self._connection().executescript(SCHEMA)
+            self._schema_ready = True
+
+    def _ingest(self, documents: Iterable[Dict]) -> int:
+        self._ensure_schema()
+        connection = self._connection()
+        count = 0
+        batch = []
+        with connection:
+            for document in documents:
+                metadata = document.get("metadata")
+                batch.append((document.get("title", ""), document.get("body", ""),
+                              json.dumps(metadata) if metadata is not None else None))
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    connection.executemany(INSERT_SQL, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                connection.executemany(INSERT_SQL, batch)
+                count += len(batch)
+            # One index rebuild is much faster than per-row trigger updates for bulk loads
+            connection.execute("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')")
+        connection.execute("INSERT INTO documents_fts(documents_fts) VALUES ('optimize')")
+        return count
+
+    def _search(self, match: str, page: int, page_size: int) -> Dict[str, Any]:
+        self._ensure_schema()
+        connection = self._connection()
+        offset = (page - 1) * page_size
+        # Fetch one extra row to know whether a next page exists without a COUNT(*)
+        rows = connection.execute(SEARCH_SQL, (SNIPPET_TOKENS, match, page_size + 1, offset)).fetchall()
+        results = [{
+            "id": row["id"],
+            "title": row["title"],
+            "snippet": row["snippet"],
+            "metadata": json.loads(row["metadata"]) if row["metadata"] else None,
+            "score": round(row["score"], 4),
+        } for row in rows[:page_size]]
+        return {"results": results, "page": page, "page_size": page_size,
+                "next_page": page + 1 if len(rows) > page_size else None}
+
+    def _count(self, match: str) -> int:
+        return self._connection().execute(COUNT_SQL, (match,)).fetchone()[0]
+
+    # ---- Async API ----
+
+    async def ingest(self, documents: Iterable[Dict]) -> int:
+        return await self._run(self._ingest, documents)
+
+    async def ensure_schema(self):
+        await self._run(self._ensure_schema)
+
+    async def search(self, query: str, page: int = 1, page_size: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        """One page of bm25-ranked results: { results, page, page_size, next_page }"""
+        match = build_match_query(query)
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        if match is None:
+            return {"results": [], "page": page, "page_size": page_size, "next_page": None}
+        return await self._run(self._search, match, max(1, page), page_size)
+
+    async def count(self, query: str) -> int:
+        match = build_match_query(query)
+        return await self._run(self._count, match) if match else 0
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+# ============================================================================
+# SECTION 4: BULK INGEST & BENCHMARK COMMANDS
+# ============================================================================
+
+def read_jsonl(path: str) -> Iterable[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+SYNTHETIC_VOCABULARY = 20_000
+
+def synthetic_vocabulary(seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choices(letters, k=rng.randint(4, 9))) for _ in range(SYNTHETIC_VOCABULARY)]
+
+def synthetic_documents(count: int, seed: int = 1) -> Iterable[Dict]:
+    """Documents with a Zipf-like word distribution (a few very common words, a long tail)"""
+    rng = random.Random(seed)
+    vocabulary = synthetic_vocabulary(seed)
+    cumulative, total = [], 0.0
+    for rank in range(len(vocabulary)):
+        total += 1.0 / (rank + 1)
+        cumulative.append(total)
+    for i in range(count):
+        words = rng.choices(vocabulary, cum_weights=cumulative, k=64)
+        yield {
+            "title": " ".join(words[:4]).title(),
+            "body": " ".join(words[4:]),
+            "metadata": {"source": "synthetic", "n": i},
+        }
+
+async def benchmark(index: SearchIndex, chats: int, queries_per_chat: int, seed: int = 2) -> Dict[str, Any]:
+    """Concurrent chats each issuing sequential searches; returns queries/sec and latency percentiles"""
+    rng = random.Random(seed)
+    vocabulary = synthetic_vocabulary()
+    latencies: List[float] = []
+
+    async def chat(queries: List[str]):
+        for query in queries:
+            started = time.perf_counter()
+            await index.search(query)
+            latencies.append(time.perf_counter() - started)
+
+    # One to three words from outside the most frequent 100, like real topic searches
+    workloads = [[" ".join(rng.choices(vocabulary[100:2000], k=rng.randint(1, 3))) for _ in range(queries_per_chat)]
+                 for _ in range(chats)]
+    started = time.perf_counter()
+    await asyncio.gather(*[chat(queries) for queries in workloads])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "queries": len(latencies),
+        "seconds": round(elapsed, 3),
+        "qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+    }
+
+async def run_command(args):
+    index = SearchIndex(args.db, pool_size=args.pool)
+    try:
+        if args.command == "ingest":
+            started = time.perf_counter()
+            count = await index.ingest(read_jsonl(args.source))
+            print(f"📥 Ingested {count} documents into {args.db} in {time.perf_counter() - started:.2f}s")
+        else:
+            await index.ensure_schema()
+            if args.synthetic:
+                started = time.perf_counter()
+                count = await index.ingest(synthetic_documents(args.synthetic))
+                print(f"📥 Ingested {count} synthetic documents in {time.perf_counter() - started:.2f}s")
+            result = await benchmark(index, args.chats, args.queries)
+            print(f"⚡ {result['queries']} queries from {args.chats} concurrent chats "
+                  f"(pool of {args.pool}) in {result['seconds']}s")
+            print(f"   {result['qps']} queries/sec | p50 {result['p50_ms']}ms | p95 {result['p95_ms']}ms")
+    finally:
+        index.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite FTS5 search backend for the search_database tool")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help="Bulk load a JSONL file of {title, body, metadata}")
+    ingest.add_argument("db")
+    ingest.add_argument("source")
+
+    bench = sub.add_parser("bench", help="Queries/sec under concurrent chats")
+    bench.add_argument("db")
+    bench.add_argument("--chats", type=int, default=200)
+    bench.add_argument("--queries", type=int, default=25, help="Queries per chat")
+    bench.add_argument("--synthetic", type=int, default=0, help="Ingest N synthetic documents first")
+
+    for command in (ingest, bench):
+        command.add_argument("--pool", type=int, default=POOL_SIZE, help="Connection pool size")
+
+    asyncio.run(run_command(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+session_snapshot.py
+Crash / deploy-safe chat state: periodic incremental snapshots of session dicts to one compact
+append-only file, and a warm restart that memory-maps the file and decodes sessions lazily.
+- SnapshotStore is a drop-in dict (chat_id -> JSON-serializable value) that tracks dirty keys
+- Every snapshot appends one segment holding only what changed (tombstones for deletions)
+- Restart scans the segment headers into an index (key -> offset) without decoding values;
+  a session is decoded from the mmap the first time its chat comes back
+- The file is rewritten compactly once old versions outweigh live data
+- A torn last segment (crash mid-write) is ignored and truncated away
+
+Usage:
+    python session_snapshot.py bench --sessions 1000000
+"""
+
+import os
+import json
+import mmap
+import time
+import struct
+import random
+import asyncio
+import argparse
+import itertools
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+
+try:
+    import orjson  # Optional: faster encode / decode, same JSON on disk
+except ImportError:
+    orjson = None
+
+# ============================================================================
+# SECTION 1: CONFIGURATION & FORMAT
+# ============================================================================
+
+SNAPSHOT_DIR = os.getenv("SESSION_SNAPSHOT_DIR")         # Unset = in-memory only (no snapshots)
+SNAPSHOT_INTERVAL = float(os.getenv("SESSION_SNAPSHOT_INTERVAL", "5"))
+COMPACT_RATIO = 3             # Rewrite once the file holds 3x more records than live keys
+COMPACT_MIN_RECORDS = 10_000  # ... and at least this many records
+SNAPSHOT_FSYNC = os.getenv("SESSION_SNAPSHOT_FSYNC", "1") == "1"
+
+# Segment: magic, record count, payload bytes | records: key length, value length, key, value
+SEGMENT_HEADER = struct.Struct("<4sIQ")
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_MAGIC = b"SSEG"
+TOMBSTONE = 0xFFFFFFFF        # Value length of a deleted key
+
+Record = Tuple[bytes, Optional[bytes]]  # (key, JSON value or None = deleted)
+
+def encode_value(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def decode_value(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def build_segment(records: List[Record]) -> Tuple[bytes, List[int]]:
+    """Segment bytes + offset of each record's value within the segment (-1 for tombstones)"""
+    parts = []
+    value_offsets = []
+    position = SEGMENT_HEADER.size
+    for key, value in records:
+        parts.append(RECORD_HEADER.pack(len(key), TOMBSTONE if value is None else len(value)))
+        parts.append(key)
+        position += RECORD_HEADER.size + len(key)
+        if value is None:
+            value_offsets.append(-1)
+        else:
+            parts.append(value)
+            value_offsets.append(position)
+            position += len(value)
+    payload = b"".join(parts)
+    return SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(records), len(payload)) + payload, value_offsets
+
+def scan_segments(data: Any, size: int) -> Tuple[Dict[str, Tuple[int, int]], int, int]:
+    """
+    Index of the latest value of every key: key -> (value offset, value length).
+    Returns (index, end of the last complete segment, records seen)
+    """
+    index: Dict[str, Tuple[int, int]] = {}
+    unpack_record = RECORD_HEADER.unpack_from
+    offset = 0
+    records = 0
+    while offset + SEGMENT_HEADER.size <= size:
+        magic, count, payload = SEGMENT_HEADER.unpack_from(data, offset)
+        end = offset + SEGMENT_HEADER.size + payload
+        if magic != SEGMENT_MAGIC or end > size:
+            break  # Torn or foreign tail: everything before it is still good
+        position = offset + SEGMENT_HEADER.size
+        for _ in range(count):
+            key_length, value_length = unpack_record(data, position)
+            position += RECORD_HEADER.size
+            key = data[position:position + key_length].decode("utf-8")
+            position += key_length
+            if value_length == TOMBSTONE:
+                index.pop(key, None)
+            else:
+                index[key] = (position, value_length)
+                position += value_length
+        records += count
+        offset = end
+    return index, offset, records
+
+# ============================================================================
+# SECTION 2: SNAPSHOT STORE
+# ============================================================================
+
+class SnapshotStore(MutableMapping):
+    """
+    dict-like store backed by a snapshot file.
+    - _live: decoded values (everything touched since start)
+    - _index: keys still only on disk (key -> location in the mmap)
+    - _clean: locations of loaded keys whose disk copy is current (copied raw on compaction)
+    Values mutated in place must be flagged with mark_dirty(key); assignments are tracked.
+    Not thread-safe: use from the event loop thread (snapshot_async does its I/O in a thread;
+    call snapshot() only when no snapshot_async write is pending, see flush()).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._live: Dict[str, Any] = {}
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._clean: Dict[str, Tuple[int, int]] = {}
+        self._dirty: set = set()
+        self._mmap: Optional[mmap.mmap] = None
+        self._records_on_disk = 0
+        self._file_size = 0
+        self._rewrite = False
+        self._pending: Optional[asyncio.Future] = None  # snapshot_async write in progress
+        self.snapshots = 0
+        self.restore_seconds = 0.0
+        if path:
+            self._load()
+
+    # ---- Restore ----
+
+    def _load(self):
+        started = time.perf_counter()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "r+b") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index, valid_end, self._records_on_disk = scan_segments(self._mmap, len(self._mmap))
+            if valid_end < len(self._mmap):
+                f.truncate(valid_end)  # Drop a torn last segment before appending after it
+            self._file_size = valid_end
+        self.restore_seconds = time.perf_counter() - started
+
+    def _read(self, location: Tuple[int, int]) -> Any:
+        offset, length = location
+        return decode_value(self._mmap[offset:offset + length])
+
+    # ---- Mapping API ----
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self._live[key]
+        except KeyError:
+            location = self._index.pop(key)  # KeyError if unknown
+        value = self._live[key] = self._read(location)
+        self._clean[key] = location
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._live or key in self._index
+
+    def __setitem__(self, key: str, value: Any):
+        self._live[key] = value
+        self._index.pop(key, None)
+        self._clean.pop(key, None)
+        self._dirty.add(key)
+
+    def __delitem__(self, key: str):
+        if key in self._live:
+            del self._live[key]
+            self._clean.pop(key, None)
+        else:
+            del self._index[key]
+        self._dirty.add(key)
+
+    def __len__(self) -> int:
+        return len(self._live) + len(self._index)
+
+    def __iter__(self) -> Iterator[str]:
+        return itertools.chain(list(self._live), list(self._index))
+
+    def clear(self):
+        self._live.clear()
+        self._index.clear()
+        self._clean.clear()
+        self._dirty.clear()
+        self._rewrite = True  # Next snapshot writes an empty file
+
+    def mark_dirty(self, key: str):
+        """Flag an in-place change of self[key] for the next snapshot"""
+        if key in self._live:
+            self._clean.pop(key, None)
+            self._dirty.add(key)
+
+    # ---- Snapshots ----
+
+    def _take_dirty(self) -> List[Record]:
+        """Encode changed keys (on the owning thread, so values can't change mid-encode)"""
+        records = []
+        for key in self._dirty:
+            value = self._live.get(key, self)
+            records.append((key.encode("utf-8"), None if value is self else encode_value(value)))
+        self._dirty.clear()
+        return records
+
+    def _needs_compaction(self, new_records: int) -> bool:
+        total = self._records_on_disk + new_records
+        return self._rewrite or (total >= COMPACT_MIN_RECORDS and total > COMPACT_RATIO * max(1, len(self)))
+
+    def _append(self, segment: bytes):
+        with open(self.path, "ab") as f:
+            f.write(segment)
+            f.flush()
+            if SNAPSHOT_FSYNC:
+                os.fsync(f.fileno())
+
+    def _appended(self, records: List[Record], segment: bytes, value_offsets: List[int]):
+        """Appended values are now the current disk copy of their (still clean) keys"""
+        for (key, value), offset in zip(records, value_offsets):
+            name = key.decode("utf-8")
+            if value is not None and name not in self._dirty and name in self._live:
+                self._clean[name] = (self._file_size + offset, len(value))
+        self._file_size += len(segment)
+        self._records_on_disk += len(records)
+
+    def _compaction_plan(self) -> Tuple[List[Record], Dict[str, Tuple[int, int]]]:
+        """Everything live: encoded dirty records + disk locations of unchanged keys"""
+        records = [record for record in self._take_dirty() if record[1] is not None]
+        on_disk = {**self._index, **self._clean}
+        return records, on_disk
+
+    def _write_compacted(self, records: List[Record],
+                         on_disk: Dict[str, Tuple[int, int]]) -> Tuple[Dict[str, Tuple[int, int]], int]:
+        """Write a single-segment file; unchanged values are copied raw from the current file"""
+        copied = []
+        if on_disk:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                copied = [(key.encode("utf-8"), source[offset:offset + length])
+                          for key, (offset, length) in on_disk.items()]
+        segment, value_offsets = build_segment(copied + records)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(segment)
+            f.flush()
+            if SNAPSHOT_FSYNC:
+                os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+        all_records = copied + records
+        locations = {key.decode("utf-8"): (offset, len(value))
+                     for (key, value), offset in zip(all_records, value_offsets)}
+        return locations, len(segment)
+
+    def _swap(self, locations: Dict[str, Tuple[int, int]], file_size: int):
+        """Point cold / clean keys at the compacted file (keys changed meanwhile stay dirty)"""
+        old_mmap = self._mmap
+        self._mmap = None
+        if file_size > SEGMENT_HEADER.size:
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index = {key: locations[key] for key in self._index if key in locations}
+        self._clean = {key: locations[key] for key in self._live
+                       if key in locations and key not in self._dirty}
+        self._records_on_disk = len(locations)
+        self._file_size = file_size
+        self._rewrite = False
+        if old_mmap is not None:
+            old_mmap.close()
+
+    def snapshot(self) -> int:
+        """Write changes since the last snapshot (blocking); returns the number of records written"""
+        if not self.path or not (self._dirty or self._rewrite):
+            return 0
+        if self._needs_compaction(len(self._dirty)):
+            locations, file_size = self._write_compacted(*self._compaction_plan())
+            self._swap(locations, file_size)
+            written = len(locations)
+        else:
+            records = self._take_dirty()
+            segment, value_offsets = build_segment(records)
+            self._append(segment)
+            self._appended(records, segment, value_offsets)
+            written = len(records)
+        self.snapshots += 1
+        return written
+
+    async def snapshot_async(self) -> int:
+        """
+        snapshot() with encoding on the loop and file I/O in a worker thread.
+        The write runs as its own task: cancelling the caller never leaves it half-applied,
+        and flush() waits for it before the final snapshot.
+        """
+        if not self.path or not (self._dirty or self._rewrite) or self._pending is not None:
+            return 0
+        self._pending = asyncio.ensure_future(self._write_async())
+        self._pending.add_done_callback(self._write_done)
+        return await asyncio.shield(self._pending)
+
+    def _write_done(self, _task: asyncio.Future):
+        self._pending = None
+
+    async def _write_async(self) -> int:
+        if self._needs_compaction(len(self._dirty)):
+            locations, file_size = await asyncio.to_thread(self._write_compacted, *self._compaction_plan())
+            self._swap(locations, file_size)
+            written = len(locations)
+        else:
+            records = self._take_dirty()
+            segment, value_offsets = build_segment(records)
+            await asyncio.to_thread(self._append, segment)
+            self._appended(records, segment, value_offsets)
+            written = len(records)
+        self.snapshots += 1
+        return written
+
+    async def flush(self) -> int:
+        """Wait for a running snapshot_async write, then write what is still dirty (blocking)"""
+        pending = self._pending
+        if pending is not None:
+            await asyncio.wait([pending])  # Its errors surface to the snapshot_async caller
+        return self.snapshot()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self),
+            "decoded": len(self._live),
+            "dirty": len(self._dirty),
+            "records_on_disk": self._records_on_disk,
+            "snapshots": self.snapshots,
+            "restore_seconds": round(self.restore_seconds, 3),
+        }
+
+# ============================================================================
+# SECTION 3: STARTUP & PERIODIC SNAPSHOTS
+# ============================================================================
+
+def open_store(name: str, directory: Optional[str] = SNAPSHOT_DIR) -> SnapshotStore:
+    """<directory>/<name>.snap restored lazily; in-memory only when no directory is configured"""
+    if not directory:
+        return SnapshotStore()
+    os.makedirs(directory, exist_ok=True)
+    store = SnapshotStore(os.path.join(directory, f"{name}.snap"))
+    if len(store):
+        print(f"♻️ Restored {len(store)} {name} entries in {store.restore_seconds:.2f}s (lazy decode)")
+    return store
+
+async def snapshot_periodically(*stores: SnapshotStore, interval: float = SNAPSHOT_INTERVAL):
+    """Background task: snapshot every interval; a final snapshot runs when cancelled"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            for store in stores:
+                await store.snapshot_async()
+    finally:
+        for store in stores:
+            await store.flush()  # After any write still running in its worker thread
+
+# ============================================================================
+# SECTION 4: BENCHMARK (1M SESSIONS)
+# ============================================================================
+
+def synthetic_session(rng: random.Random, i: int) -> Dict:
+    return {
+        "sessionID": f"session{i}",
+        "sessionLengthCounter": rng.randint(0, 5),
+        "chatSessionID": f"resp_{rng.getrandbits(96):024x}",
+        "customContext": {},
+        "interactionHistory": [],
+        "chatHistory": [{"role": "user", "message": f"Message {n} from chat {i}"} for n in range(rng.randint(0, 4))],
+    }
+
+def bench(path: str, sessions: int, touched: float, seed: int = 1):
+    rng = random.Random(seed)
+    for stale in (path, f"{path}.tmp"):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    store = SnapshotStore(path)
+    started = time.perf_counter()
+    for i in range(sessions):
+        store[f"chat{i}"] = synthetic_session(rng, i)
+    print(f"🧱 Built {sessions} sessions in memory in {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    written = store.snapshot()
+    print(f"💾 Full snapshot: {written} records, {os.path.getsize(path) / 1e6:.1f} MB "
+          f"in {time.perf_counter() - started:.2f}s")
+
+    changed = rng.sample(range(sessions), int(sessions * touched))
+    for i in changed:
+        session = store[f"chat{i}"]
+        session["sessionLengthCounter"] += 1
+        store.mark_dirty(f"chat{i}")
+    started = time.perf_counter()
+    written = store.snapshot()
+    print(f"💾 Incremental snapshot: {written} changed sessions in {time.perf_counter() - started:.3f}s")
+    del store
+
+    started = time.perf_counter()
+    restored = SnapshotStore(path)
+    ready = time.perf_counter() - started
+    print(f"♻️ Restart: {len(restored)} sessions indexed from the mmap in {ready:.2f}s (nothing decoded yet)")
+
+    probes = [f"chat{rng.randrange(sessions)}" for _ in range(10_000)]
+    started = time.perf_counter()
+    for key in probes:
+        restored[key]
+    per_lookup = (time.perf_counter() - started) / len(probes)
+    check = changed[0]
+    print(f"🔎 First access (lazy decode): {per_lookup * 1e6:.1f}µs per session | "
+          f"chat{check} counter carried over: {restored[f'chat{check}']['sessionLengthCounter']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Session snapshots and warm restart")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="Snapshot + restart timings for N synthetic sessions")
+    bench_parser.add_argument("--sessions", type=int, default=1_000_000)
+    bench_parser.add_argument("--touched", type=float, default=0.01, help="Share of sessions changed between snapshots")
+    bench_parser.add_argument("--path", default="bench_sessions.snap")
+    args = parser.parse_args()
+    bench(args.path, args.sessions, args.touched)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+simulation.py
+Deterministic virtual-clock simulation of the chatbot engine (responsesAPIchatbot.py).
+Runs the real engine (admission control, scheduler, sessions, resets) on an event loop whose
+clock only advances when every task is waiting, against a simulated model backend with
+sampled latency. Waiting costs no wall time, so a run is bound by the engine's own Python work
+per request (admission, scheduler, session updates, usage accounting: ~190µs on one core):
+10,000 users x 20 turns (200k requests, ~200s virtual) take ~40s. The same seed gives the same
+run. Isolation, ordering and reset invariants are checked at the end (with
+CONVERSATION_MODE=stateless: no resets and no previous_response_id instead).
+
+Usage:
+    python simulation.py --users 10000 --turns 20 --seed 7
+"""
+
+import asyncio
+import argparse
+import contextlib
+import hashlib
+import logging
+import os
+import math
+import random
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Any
+from mock_backend import build_response, count_tokens, input_text, ensure_placeholder_credentials
+from log_pipeline import ROOT_LOGGER, flush_logs
+from conversation_state import MODE_STATELESS
+
+# ============================================================================
+# SECTION 1: VIRTUAL-TIME EVENT LOOP
+# ============================================================================
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose time() is virtual: whenever the loop would sleep until the next timer,
+    the clock jumps there instead. Real I/O and threads still work, they just take no
+    virtual time, so simulated components should wait with asyncio.sleep().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._virtual_now = 0.0
+        real_select = self._selector.select
+
+        def select(timeout: Optional[float] = None):
+            if timeout is None:
+                return real_select(None)  # Nothing scheduled: wait for real I/O / threads
+            if timeout > 0:
+                self._virtual_now += timeout
+            return real_select(0)
+
+        self._selector.select = select
+
+    def time(self) -> float:
+        return self._virtual_now
+
+# ============================================================================
+# SECTION 2: SIMULATED MODEL BACKEND
+# ============================================================================
+
+MESSAGE_TAG = re.compile(r"\[sim:(?P<user>[^#\]]+)#(?P<turn>\d+)\]")
+
+class SimulatedBackend:
+    """
+    Duck-types ClientPool (create / create_embeddings) with latency sampled from a
+    log-normal distribution in virtual time. Records every call so invariants can be
+    checked after the run.
+    """
+
+    def __init__(self, rng: random.Random, mean_latency: float = 1.2, sigma: float = 0.5):
+        self.rng = rng
+        self.mean_latency = mean_latency
+        self.sigma = sigma
+        self.next_id = 0
+        self.response_owner: Dict[str, str] = {}        # response_id -> user_id
+        self.last_response: Dict[str, str] = {}         # user_id -> latest response_id
+        self.calls: Dict[str, List[Dict]] = defaultdict(list)
+        self.violations: List[str] = []
+
+    def sample_latency(self) -> float:
+        # Log-normal with the requested mean: mu = ln(mean) - sigma^2 / 2
+        return self.rng.lognormvariate(math.log(self.mean_latency) - self.sigma ** 2 / 2, self.sigma)
+
+    def owner_of(self, response_id: Optional[str]) -> Optional[str]:
+        return "sim" if response_id in self.response_owner else None  # One simulated endpoint
+
+    async def create(self, payload: Dict, owner: Optional[str] = None) -> Any:
+        text = input_text(payload)
+        tags = MESSAGE_TAG.findall(text)
+        user_id, turn = (tags[-1][0], int(tags[-1][1])) if tags else ("?", -1)
+        previous_id = payload.get("previous_response_id")
+        is_reset = "CONTEXT: Continuing from recent conversation." in text
+
+        # Isolation: every tagged message in the input belongs to the same user,
+        # and a chained call must continue this user's latest response
+        if any(tag_user != user_id for tag_user, _ in tags):
+            self.violations.append(f"input for {user_id} contains another user's messages")
+        if previous_id is not None:
+            owner = self.response_owner.get(previous_id)
+            if owner != user_id:
+                self.violations.append(f"{user_id} chained onto a response of {owner}")
+            elif previous_id != self.last_response.get(user_id):
+                self.violations.append(f"{user_id} turn {turn} chained onto a stale response")
+
+        await asyncio.sleep(self.sample_latency())
+
+        self.next_id += 1
+        response_id = f"resp_sim_{self.next_id}"
+        self.response_owner[response_id] = user_id
+        self.last_response[user_id] = response_id
+        self.calls[user_id].append({"turn": turn, "reset": is_reset, "chained": previous_id is not None,
+                                    "response_id": response_id})
+
+        reply = f"Reply to [sim:{user_id}#{turn}]"
+        return build_response(response_id, reply, count_tokens(text), 0)
+
+    async def create_embeddings(self, payload: Dict) -> Any:
+        from mock_backend import MockEmbeddings
+        await asyncio.sleep(0.01)
+        return MockEmbeddings().create(**payload)
+
+# ============================================================================
+# SECTION 3: SIMULATED USERS
+# ============================================================================
+
+async def simulated_user(engine, user_id: str, turns: int, rng: random.Random,
+                         ramp: float, think_mean: float, records: List[Dict]):
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(rng.uniform(0, ramp))
+    for turn in range(turns):
+        if turn:
+            await asyncio.sleep(rng.expovariate(1 / think_mean))
+        sent_at = loop.time()
+        record = {"user_id": user_id, "turn": turn, "sent_at": sent_at, "reply": None, "error": None}
+        try:
+            record["reply"] = await engine.send_message({
+                "chatId": user_id,
+                "sessionID": f"sim-{user_id}",
+                "message": f"[sim:{user_id}#{turn}] Message {turn} from {user_id}",
+            })
+        except Exception as err:
+            record["error"] = f"{type(err).__name__}: {err}"
+        record["received_at"] = loop.time()
+        records.append(record)
+
+# ============================================================================
+# SECTION 4: INVARIANTS
+# ============================================================================
+
+def check_invariants(engine, backend: SimulatedBackend, records: List[Dict], turns: int) -> List[str]:
+    violations = list(backend.violations)
+    stateless = engine.CONVERSATION_MODE == MODE_STATELESS
+    by_user: Dict[str, List[Dict]] = defaultdict(list)
+    for record in records:
+        by_user[record["user_id"]].append(record)
+
+    for user_id, user_records in by_user.items():
+        if len(user_records) != turns:
+            violations.append(f"{user_id}: {len(user_records)} of {turns} turns finished")
+
+        # Per-user ordering: turns finish in order and never overlap
+        for previous, current in zip(user_records, user_records[1:]):
+            if current["turn"] != previous["turn"] + 1 or current["sent_at"] < previous["received_at"]:
+                violations.append(f"{user_id}: turn {current['turn']} out of order")
+
+        for record in user_records:
+            error = record["error"] or ""
+            if "Please wait" in error:
+                violations.append(f"{user_id}: turn {record['turn']} hit the duplicate-request guard")
+            # Routing: the reply must answer this user's own message
+            if record["reply"] is not None and not record["reply"].startswith("We're handling") \
+                    and record["reply"] != f"Reply to [sim:{user_id}#{record['turn']}]":
+                violations.append(f"{user_id}: turn {record['turn']} got someone else's reply")
+
+        if stateless:
+            # Stateless turns carry their own context: no reset calls, no server-side chain
+            calls = backend.calls[user_id]
+            if any(call["reset"] for call in calls):
+                violations.append(f"{user_id}: context reset sent in stateless mode")
+            if any(call["chained"] for call in calls):
+                violations.append(f"{user_id}: previous_response_id sent in stateless mode")
+            continue
+
+        # Reset timing: one reset call after every CONTEXT_PAIRS_LIMIT answered turns
+        answered = sum(1 for r in user_records if r["reply"] is not None and r["error"] is None)
+        resets = [call["turn"] for call in backend.calls[user_id] if call["reset"]]
+        expected = answered // engine.CONTEXT_PAIRS_LIMIT
+        if len(resets) != expected:
+            violations.append(f"{user_id}: {len(resets)} context resets, expected {expected}")
+        elif answered == len(user_records):
+            limit = engine.CONTEXT_PAIRS_LIMIT
+            if resets != [t for t in range(turns) if (t + 1) % limit == 0]:
+                violations.append(f"{user_id}: context resets at turns {resets}")
+
+    return violations
+
+# ============================================================================
+# SECTION 5: RUN
+# ============================================================================
+
+async def run_simulation(users: int, turns: int, seed: int, mean_latency: float, think_mean: float,
+                         ramp: float, upstream_slots: int, max_in_flight: int) -> Dict[str, Any]:
+    import responsesAPIchatbot as engine
+    from scheduler import FairScheduler
+    from admission import AdmissionController
+
+    rng = random.Random(seed)
+    backend = SimulatedBackend(random.Random(seed + 1), mean_latency)
+
+    # Fresh engine state wired to the simulated backend
+    engine.client_pool = backend
+    engine.scheduler = FairScheduler(max_concurrent=upstream_slots)
+    engine.admission = AdmissionController(max_in_flight=max_in_flight, max_queue_depth=max_in_flight,
+                                           queue_depth_fn=engine.scheduler.queued_count)
+    engine.session_store.clear()
+    engine.active_user_sessions.clear()
+    engine.LONG_TERM_MEMORY_ENABLED = False
+
+    records: List[Dict] = []
+    user_ids = [f"u{i:05d}" for i in range(users)]
+    user_rngs = [random.Random(rng.random()) for _ in user_ids]
+
+    await asyncio.gather(*[
+        simulated_user(engine, user_id, turns, user_rng, ramp, think_mean, records)
+        for user_id, user_rng in zip(user_ids, user_rngs)
+    ])
+
+    records.sort(key=lambda r: (r["user_id"], r["turn"]))
+    latencies = sorted(r["received_at"] - r["sent_at"] for r in records if r["error"] is None)
+    fingerprint = hashlib.sha256(
+        "".join(f"{r['user_id']}{r['turn']}{r['sent_at']:.9f}{r['received_at']:.9f}{r['error']}"
+                for r in records).encode("utf-8")
+    ).hexdigest()[:16]
+
+    return {
+        "requests": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "virtual_seconds": asyncio.get_running_loop().time(),
+        "p50": latencies[len(latencies) // 2] if latencies else float("nan"),
+        "p95": latencies[int(len(latencies) * 0.95)] if latencies else float("nan"),
+        "admission": engine.admission.metrics()["decisions"],
+        "mode": engine.CONVERSATION_MODE,
+        "violations": check_invariants(engine, backend, records, turns),
+        "fingerprint": fingerprint,
+    }
+
+def simulate(users: int = 10_000, turns: int = 20, seed: int = 7, mean_latency: float = 1.2,
+             think_mean: float = 3.0, ramp: float = 60.0, upstream_slots: int = 4096,
+             max_in_flight: Optional[int] = None, quiet: bool = True) -> Dict[str, Any]:
+    """
+    Run one simulation on a fresh virtual-time loop (engine prints are muted when quiet).
+    max_in_flight defaults to one request per user, i.e. admission control never sheds;
+    lower it (and upstream_slots) to simulate overload.
+    """
+    ensure_placeholder_credentials()  # The engine builds ClientPool.from_env() on import
+    import responsesAPIchatbot  # Import (and set up logging) before muting, or setup resets the level
+
+    loop = VirtualTimeEventLoop()
+    chatbot_logger = logging.getLogger(ROOT_LOGGER)
+    previous_level = chatbot_logger.level
+    try:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+            if quiet:
+                chatbot_logger.setLevel(logging.WARNING)  # Skip per-request logs, not just their output
+            try:
+                return loop.run_until_complete(run_simulation(
+                    users, turns, seed, mean_latency, think_mean, ramp, upstream_slots, max_in_flight or users))
+            finally:
+                flush_logs()  # Buffered records still go to devnull
+    finally:
+        chatbot_logger.setLevel(previous_level)
+        loop.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual-clock simulation of the chatbot engine")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--latency", type=float, default=1.2, help="Mean simulated model latency (s)")
+    parser.add_argument("--think", type=float, default=3.0, help="Mean think time between turns (s)")
+    parser.add_argument("--ramp", type=float, default=60.0, help="Users arrive uniformly over this window (s)")
+    parser.add_argument("--slots", type=int, default=4096, help="Scheduler upstream concurrency cap")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Admission control in-flight / queue limit (default: number of users)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = simulate(args.users, args.turns, args.seed, args.latency, args.think, args.ramp,
+                      args.slots, args.max_in_flight)
+    wall = time.perf_counter() - started
+
+    print(f"\n🧪 Simulated {result['requests']} requests ({args.users} users x {args.turns} turns)")
+    print(f"   Virtual time: {result['virtual_seconds']:.1f}s | Wall time: {wall:.1f}s "
+          f"({wall / max(1, result['requests']) * 1e6:.0f}µs engine work per request)")
+    print(f"   Latency p50 {result['p50']:.3f}s  p95 {result['p95']:.3f}s | Errors: {result['errors']}")
+    print(f"   Admission decisions: {result['admission']}")
+    print(f"   Run fingerprint (same seed -> same value): {result['fingerprint']}")
+
+    violations = result["violations"]
+    if violations:
+        print(f"\n❌ {len(violations)} invariant violations, first ones:")
+        for violation in violations[:20]:
+            print(f"   - {violation}")
+        raise SystemExit(1)
+    checked = "stateless (no reset, no chain)" if result["mode"] == MODE_STATELESS else "reset"
+    print(f"\n✅ Isolation, ordering and {checked} invariants hold")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+sync_client.py
+Thread-safe synchronous facade for main.py-style callers (scripts, WSGI apps, worker threads).
+One long-lived background event loop owns the shared async client pool and the fair scheduler;
+send() / send_many() can be called from any thread and return concurrent.futures.Future objects.
+Sync code gets connection reuse and many requests in flight without asyncio.run() per call
+or a thread per request.
+
+Usage:
+    with SyncChatClient() as chat:
+        future = chat.send("Where is the Taj Mahal?", chat_id="a1")
+        print(future.result().output_text)
+
+    python sync_client.py --threads 8 --messages 50      # demo on the mock backend
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple, Any
+from openai import AsyncOpenAI
+from client_pool import ClientPool, ChainUnavailable
+from scheduler import FairScheduler, estimate_request_cost, PRIORITY_INTERACTIVE
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+DEFAULT_MODEL = "gpt-4.1-mini"
+MAX_CONCURRENT_UPSTREAM = int(os.getenv("MAX_CONCURRENT_UPSTREAM", "16"))
+MAX_TRACKED_CHATS = 100_000  # chat_id -> previous_response_id entries kept
+
+# ============================================================================
+# SECTION 2: SYNC FACADE
+# ============================================================================
+
+class SyncChatClient:
+    """
+    Blocking-world entry point to the async stack.
+    - chat_id given: turns are chained with previous_response_id and run in order per chat
+      (like user_cache in mainasync.py); different chats run concurrently
+    - chat_id None: one-off request, no chaining
+    All loop-owned state (chains, per-chat locks) is only touched on the loop thread.
+    """
+
+    def __init__(self, pool: Optional[ClientPool] = None, model: str = DEFAULT_MODEL,
+                 max_concurrent: int = MAX_CONCURRENT_UPSTREAM):
+        # The async client is native asyncio: the pool awaits it directly instead of to_thread
+        self.pool = pool or ClientPool.from_env(client_factory=AsyncOpenAI)
+        self.model = model
+        self.scheduler = FairScheduler(max_concurrent=max_concurrent)
+
+        self._chains: Dict[str, Tuple[str, Optional[str]]] = {}  # chat_id -> (previous_response_id, endpoint)
+        self._chat_locks: Dict[str, asyncio.Lock] = {}
+        self._chat_pending: Dict[str, int] = {}           # Turns queued or running per chat
+        self._closed = False
+
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="sync-client-loop", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._ready.set)
+        self._loop.run_forever()
+
+    # ---- Async side (runs on the background loop) ----
+
+    async def _send(self, message: Any, chat_id: Optional[str], priority: str, options: Dict) -> Any:
+        payload = {"model": self.model, "input": message, **options}
+        scheduler_key = chat_id or "anonymous"
+
+        if chat_id is None:
+            async with self.scheduler.slot(scheduler_key, priority=priority, cost=estimate_request_cost(payload)):
+                return await self.pool.create(payload)
+
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_pending[chat_id] = self._chat_pending.get(chat_id, 0) + 1
+        try:
+            async with lock:  # Turns of one chat must see the previous turn's response id
+                previous_response_id, owner = self._chains.get(chat_id, (None, None))
+                if previous_response_id:
+                    payload["previous_response_id"] = previous_response_id
+                async with self.scheduler.slot(scheduler_key, priority=priority,
+                                               cost=estimate_request_cost(payload)):
+                    try:
+                        response = await self.pool.create(payload, owner=owner)
+                    except ChainUnavailable:
+                        payload.pop("previous_response_id")  # Chain's key is gone: new conversation
+                        response = await self.pool.create(payload)
+                self._remember(chat_id, response.id)
+                return response
+        finally:
+            self._chat_pending[chat_id] -= 1
+            if not self._chat_pending[chat_id]:  # Idle chat: drop its lock
+                del self._chat_pending[chat_id]
+                del self._chat_locks[chat_id]
+
+    def _remember(self, chat_id: str, response_id: str):
+        self._chains.pop(chat_id, None)
+        # Re-insert = most recent last; the endpoint outlives the pool's own affinity cache
+        self._chains[chat_id] = (response_id, self.pool.owner_of(response_id))
+        while len(self._chains) > MAX_TRACKED_CHATS:
+            self._chains.pop(next(iter(self._chains)))
+
+    # ---- Sync side (any thread) ----
+
+    def submit(self, coro) -> Future:
+        """Run any coroutine on the background loop (thread-safe)"""
+        if self._closed:
+            coro.close()
+            raise RuntimeError("SyncChatClient is closed")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def send(self, message: Any, chat_id: Optional[str] = None,
+             priority: str = PRIORITY_INTERACTIVE, **options: Any) -> Future:
+        """
+        Queue one Responses API call; returns a Future resolving to the response.
+        options are extra payload fields (model, max_output_tokens, ...).
+        """
+        return self.submit(self._send(message, chat_id, priority, options))
+
+    def send_many(self, requests: List[Dict]) -> List[Future]:
+        """[{"message", "chat_id"?, "priority"?, ...payload fields}] -> futures in the same order"""
+        futures = []
+        for request in requests:
+            options = {k: v for k, v in request.items() if k not in ("message", "chat_id", "priority")}
+            futures.append(self.send(request["message"], request.get("chat_id"),
+                                     request.get("priority", PRIORITY_INTERACTIVE), **options))
+        return futures
+
+    def ask(self, message: Any, chat_id: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """Blocking convenience: send and wait for the reply text"""
+        return self.send(message, chat_id).result(timeout).output_text
+
+    def previous_response_id(self, chat_id: str) -> Optional[str]:
+        return self.submit(self._get_chain(chat_id)).result()
+
+    async def _get_chain(self, chat_id: str) -> Optional[str]:
+        return self._chains.get(chat_id, (None, None))[0]
+
+    def reset(self, chat_id: str):
+        """Forget a chat's chain (its next turn starts a new conversation)"""
+        self._loop.call_soon_threadsafe(self._chains.pop, chat_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        async def collect():
+            return {"chats": len(self._chains), "scheduler": self.scheduler.stats(), "pool": self.pool.stats()}
+        return self.submit(collect()).result()
+
+    def close(self, timeout: Optional[float] = None):
+        """Wait for in-flight requests, then stop the loop"""
+        if self._closed:
+            return
+        self._closed = True
+
+        async def drain():
+            pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(drain(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._loop.close()
+
+    def __enter__(self) -> "SyncChatClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# ============================================================================
+# SECTION 3: DEMO (MANY THREADS, ONE LOOP)
+# ============================================================================
+
+def demo(threads: int, messages: int, latency: float):
+    """Several sync worker threads share one client: each thread is one chat sending in order"""
+    from mock_backend import mock_pool
+
+    with SyncChatClient(pool=mock_pool(latency=latency)) as chat:
+        def worker(index: int) -> List[str]:
+            chat_id = f"thread{index}"
+            # Fire all turns at once: the facade still runs them in order for this chat
+            futures = chat.send_many([{"message": f"Turn {n} from {chat_id}", "chat_id": chat_id}
+                                      for n in range(messages)])
+            return [future.result().output_text for future in futures]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as callers:
+            done, _ = wait([callers.submit(worker, i) for i in range(threads)])
+        elapsed = time.perf_counter() - started
+
+        replies = [reply for future in done for reply in future.result()]
+        sequential = threads * messages * latency
+        print(f"✅ {len(replies)} replies from {threads} threads in {elapsed:.2f}s "
+              f"(one blocking call at a time: ~{sequential:.1f}s)")
+        print(f"📊 {chat.stats()['scheduler']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync facade over one background event loop")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=50, help="Turns per thread (chat)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock latency per call (s)")
+    args = parser.parse_args()
+    demo(args.threads, args.messages, args.latency)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+timeline_analysis.py
+Vectorized analytics for timeline logs (async_debug_log.json, replay / soak-test logs).
+Loads send/receive events into columnar arrays and computes, without Python loops over events:
+- send -> receive pairing by correlation_id
+- concurrency over time (requests actually in flight)
+- per-user latency distributions
+- overlap (PARALLEL vs SEQUENTIAL) and client-side gaps
+- saturation point: in-flight level where latency starts to climb
+
+Usage:
+    python timeline_analysis.py async_debug_log.json
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Union, Any
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+EVENT_COLUMNS = ["time", "event", "user_id", "correlation_id"]
+SATURATION_FACTOR = 2.0   # p95 latency this many times the unloaded p95 = saturated
+MIN_SAMPLES_PER_LEVEL = 20 # Ignore concurrency levels with fewer requests
+
+# ============================================================================
+# SECTION 2: LOADING
+# ============================================================================
+
+def load_events(source: Union[str, List[Dict], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Columnar event table (time float64, event/user_id categorical, correlation_id).
+    source can be a log path (JSON / JSONL / streaming JSON), a list of timeline
+    dicts (mainasync.timeline) or a DataFrame.
+    """
+    if isinstance(source, pd.DataFrame):
+        df = source
+    elif isinstance(source, str) and source.endswith(".jsonl"):
+        df = pd.read_json(source, lines=True, dtype=False)
+    else:
+        if isinstance(source, str):
+            from replay import load_timeline
+            source = load_timeline(source)
+        df = pd.DataFrame.from_records(source, columns=EVENT_COLUMNS)
+
+    df = df[EVENT_COLUMNS].copy()
+    df["time"] = df["time"].astype("float64")
+    df["event"] = df["event"].astype("category")
+    df["user_id"] = df["user_id"].astype("category")
+    return df
+
+def pair_requests(events: pd.DataFrame) -> pd.DataFrame:
+    """One row per request: user_id, correlation_id, send_time, receive_time, latency"""
+    is_send = (events["event"] == "send").to_numpy()
+    sends = events.loc[is_send, ["correlation_id", "user_id", "time"]]
+    receives = events.loc[events["event"].to_numpy() == "receive", ["correlation_id", "time"]]
+
+    requests = sends.merge(
+        receives.drop_duplicates("correlation_id", keep="last"),
+        on="correlation_id", how="left", suffixes=("_send", "_receive"),
+    ).rename(columns={"time_send": "send_time", "time_receive": "receive_time"})
+
+    requests["latency"] = requests["receive_time"] - requests["send_time"]
+    return requests.sort_values("send_time", kind="stable").reset_index(drop=True)
+
+# ============================================================================
+# SECTION 3: CONCURRENCY & OVERLAP
+# ============================================================================
+
+def concurrency_curve(requests: pd.DataFrame) -> pd.DataFrame:
+    """
+    Step curve of requests in flight: one row per change point (time, in_flight).
+    Requests without a receive stay in flight until the end of the log.
+    """
+    send = requests["send_time"].to_numpy()
+    receive = requests["receive_time"].to_numpy()
+    end_of_log = np.nanmax(np.concatenate([send, receive])) if len(send) else 0.0
+    receive = np.where(np.isnan(receive), end_of_log, receive)
+
+    times = np.concatenate([send, receive])
+    deltas = np.concatenate([np.ones(len(send), dtype=np.int64), -np.ones(len(receive), dtype=np.int64)])
+    # Receives sort before sends at the same timestamp, so back-to-back calls don't count twice
+    order = np.lexsort((deltas, times))
+    in_flight = np.cumsum(deltas[order])
+    return pd.DataFrame({"time": times[order], "in_flight": in_flight})
+
+def concurrency_stats(curve: pd.DataFrame) -> Dict[str, float]:
+    """Peak and time-weighted mean of the in-flight curve"""
+    times = curve["time"].to_numpy()
+    in_flight = curve["in_flight"].to_numpy()
+    if len(times) < 2:
+        return {"peak": float(in_flight.max()) if len(in_flight) else 0.0, "mean": 0.0, "duration": 0.0}
+    durations = np.diff(times)
+    total = times[-1] - times[0]
+    return {
+        "peak": float(in_flight.max()),
+        "mean": float((in_flight[:-1] * durations).sum() / total) if total > 0 else 0.0,
+        "duration": float(total),
+    }
+
+def in_flight_at(curve: pd.DataFrame, times: np.ndarray) -> np.ndarray:
+    """In-flight count just after each given timestamp (vectorized lookup on the step curve)"""
+    index = np.searchsorted(curve["time"].to_numpy(), times, side="right") - 1
+    values = curve["in_flight"].to_numpy()
+    return np.where(index >= 0, values[np.clip(index, 0, None)], 0)
+
+def overlap_flags(requests: pd.DataFrame) -> pd.DataFrame:
+    """
+    Vectorized version of main.py's PARALLEL / SEQUENTIAL check:
+    - parallel_global: sent before the previously sent request got its reply
+    - user_gap: time between a user's previous reply and this send (think / client queue time)
+    """
+    out = requests.copy()
+    previous_receive = out["receive_time"].shift(1)
+    out["parallel_global"] = out["send_time"] < previous_receive
+
+    user_previous_receive = out.groupby("user_id", observed=True)["receive_time"].shift(1)
+    out["user_gap"] = out["send_time"] - user_previous_receive
+    return out
+
+# ============================================================================
+# SECTION 4: LATENCY & SATURATION
+# ============================================================================
+
+def latency_by_user(requests: pd.DataFrame) -> pd.DataFrame:
+    """count / mean / p50 / p95 / p99 / max latency per user_id"""
+    grouped = requests.groupby("user_id", observed=True)["latency"]
+    table = grouped.agg(["count", "mean", "max"])
+    quantiles = grouped.quantile([0.5, 0.95, 0.99]).unstack()
+    quantiles.columns = ["p50", "p95", "p99"]
+    return table.join(quantiles)[["count", "mean", "p50", "p95", "p99", "max"]]
+
+def latency_vs_concurrency(requests: pd.DataFrame, curve: pd.DataFrame) -> pd.DataFrame:
+    """Latency distribution grouped by how many requests were in flight when each was sent"""
+    done = requests.dropna(subset=["latency"])
+    level = in_flight_at(curve, done["send_time"].to_numpy())
+    grouped = pd.Series(done["latency"].to_numpy()).groupby(level)
+    table = grouped.agg(["count", "mean"])
+    quantiles = grouped.quantile([0.5, 0.95]).unstack()
+    quantiles.columns = ["p50", "p95"]
+    table = table.join(quantiles)
+    table.index.name = "in_flight"
+    return table
+
+def find_saturation_point(levels: pd.DataFrame, factor: float = SATURATION_FACTOR,
+                          min_samples: int = MIN_SAMPLES_PER_LEVEL) -> Optional[int]:
+    """Lowest in-flight level whose p95 latency exceeds factor x the p95 at the lowest level"""
+    levels = levels[levels["count"] >= min_samples]
+    if levels.empty:
+        return None
+    baseline = levels["p95"].iloc[0]
+    saturated = levels.index[levels["p95"].to_numpy() > factor * baseline]
+    return int(saturated[0]) if len(saturated) else None
+
+# ============================================================================
+# SECTION 5: REPORT
+# ============================================================================
+
+def analyze(source: Union[str, List[Dict], pd.DataFrame]) -> Dict[str, Any]:
+    events = load_events(source)
+    requests = pair_requests(events)
+    curve = concurrency_curve(requests)
+    levels = latency_vs_concurrency(requests, curve)
+    flags = overlap_flags(requests)
+    latency = requests["latency"]
+
+    return {
+        "events": len(events),
+        "requests": len(requests),
+        "unanswered": int(latency.isna().sum()),
+        "latency": {
+            "mean": float(latency.mean()),
+            "p50": float(latency.quantile(0.5)),
+            "p95": float(latency.quantile(0.95)),
+            "p99": float(latency.quantile(0.99)),
+        },
+        "concurrency": concurrency_stats(curve),
+        "parallel_ratio": float(flags["parallel_global"].mean()) if len(flags) else 0.0,
+        "mean_user_gap": float(flags["user_gap"].mean()) if len(flags) else 0.0,
+        "saturation_in_flight": find_saturation_point(levels),
+        "by_user": latency_by_user(requests),
+        "by_concurrency": levels,
+        "curve": curve,
+    }
+
+def print_summary(report: Dict[str, Any], max_rows: int = 20):
+    latency = report["latency"]
+    concurrency = report["concurrency"]
+    print("\n📊 TIMELINE ANALYSIS\n")
+    print(f"   Events: {report['events']} | Requests: {report['requests']} | Unanswered: {report['unanswered']}")
+    print(f"   Latency  mean {latency['mean']:.3f}s  p50 {latency['p50']:.3f}s  "
+          f"p95 {latency['p95']:.3f}s  p99 {latency['p99']:.3f}s")
+    print(f"   In flight  peak {concurrency['peak']:.0f}  time-weighted mean {concurrency['mean']:.2f}  "
+          f"over {concurrency['duration']:.2f}s")
+    print(f"   Sent before previous reply (PARALLEL): {report['parallel_ratio']:.0%}")
+    print(f"   Mean per-user gap between reply and next send: {report['mean_user_gap']:.3f}s")
+    saturation = report["saturation_in_flight"]
+    print(f"   Saturation point: {'not reached' if saturation is None else f'{saturation} in flight'}")
+
+    print("\n👥 Latency per user (seconds)\n")
+    print(report["by_user"].head(max_rows).round(3).to_string())
+    print("\n📈 Latency vs requests in flight at send time\n")
+    print(report["by_concurrency"].head(max_rows).round(3).to_string())
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "async_debug_log.json"
+    started = time.perf_counter()
+    report = analyze(path)
+    print_summary(report)
+    print(f"\n⏱️ Analyzed in {time.perf_counter() - started:.2f}s")
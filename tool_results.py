@@ -0,0 +1,155 @@
+"""
+tool_results.py
+Compaction stage for tool results before they are sent back to the model.
+Compact JSON encoding, per-tool field projection, top-k row selection and byte/token caps,
+so a large search result doesn't turn into megabytes of pretty-printed prompt.
+"""
+
+import json
+import heapq
+from typing import Dict, List, Optional, Tuple, Any
+
+try:
+    import orjson  # Optional: faster encoder, same compact output
+except ImportError:
+    orjson = None
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+DEFAULT_MAX_BYTES = 16_000   # Cap for tools without their own limits
+BYTES_PER_TOKEN = 4          # Rough conversion for max_tokens limits
+TRUNCATION_MARKER = "...[truncated]"
+
+# ============================================================================
+# SECTION 2: ENCODING
+# ============================================================================
+
+def encode_compact(data: Any) -> str:
+    """Compact JSON (no indentation or spaces), unicode kept as-is"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=str).decode("utf-8")
+        except TypeError:
+            pass  # e.g. non-string dict keys: fall back to the stdlib encoder
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def byte_cap(limits: Dict) -> int:
+    """Effective byte budget from max_bytes and/or max_tokens"""
+    caps = []
+    if limits.get("max_bytes"):
+        caps.append(limits["max_bytes"])
+    if limits.get("max_tokens"):
+        caps.append(limits["max_tokens"] * BYTES_PER_TOKEN)
+    return min(caps) if caps else DEFAULT_MAX_BYTES
+
+# ============================================================================
+# SECTION 3: PROJECTION & TRUNCATION
+# ============================================================================
+
+def project_rows(rows: List[Any], fields: Optional[List[str]]) -> List[Any]:
+    """Keep only the declared fields of dict rows"""
+    if not fields:
+        return rows
+    return [{k: row[k] for k in fields if k in row} if isinstance(row, dict) else row for row in rows]
+
+def select_top_rows(rows: List[Any], max_rows: Optional[int], rank_by: Optional[str]) -> List[Any]:
+    """Top-k rows, by rank_by (descending) when given, else in the tool's own order"""
+    if rank_by:
+        key = lambda row: row.get(rank_by, 0) if isinstance(row, dict) else 0
+        return heapq.nlargest(max_rows, rows, key=key) if max_rows else sorted(rows, key=key, reverse=True)
+    return rows[:max_rows] if max_rows else rows
+
+def encoded_size(data: Any) -> int:
+    return len(encode_compact(data).encode("utf-8"))
+
+def shrink_row(row: Any, cap: int) -> Any:
+    """
+    Fit a single row into cap bytes by truncating its longest string fields
+    (a huge snippet shouldn't turn a successful search into an empty result)
+    """
+    if isinstance(row, str):
+        return truncate_text(row, max(0, cap - 2))  # 2 bytes for the quotes
+    if not isinstance(row, dict):
+        return row
+    row = dict(row)
+    while True:
+        excess = encoded_size(row) - cap
+        if excess <= 0:
+            return row
+        strings = [(len(v.encode("utf-8")), k) for k, v in row.items() if isinstance(v, str)]
+        if not strings:
+            return row
+        size, key = max(strings)
+        if size <= len(TRUNCATION_MARKER):
+            return row  # Nothing left to cut
+        # Cut the whole excess from the longest field, or half of it if that's not enough
+        row[key] = truncate_text(row[key], max(len(TRUNCATION_MARKER), min(size - excess, size // 2)))
+
+def fit_rows(rows: List[Any], cap: int) -> Tuple[List[Any], str]:
+    """
+    Largest prefix of rows whose encoding fits the byte cap (binary search).
+    If not even the first row fits, that row is kept with its long strings truncated.
+    """
+    low, high = 0, len(rows)
+    best = "[]"
+    while low <= high:
+        mid = (low + high) // 2
+        encoded = encode_compact(rows[:mid])
+        if len(encoded.encode("utf-8")) <= cap:
+            best, low = encoded, mid + 1
+        else:
+            high = mid - 1
+    if high <= 0 and rows:
+        first = shrink_row(rows[0], cap - 2)  # 2 bytes for the enclosing []
+        return [first], truncate_text(encode_compact([first]), cap)
+    return rows[:max(high, 0)], best
+
+def truncate_text(text: str, cap: int) -> str:
+    raw = text.encode("utf-8")
+    if len(raw) <= cap:
+        return text
+    keep = max(0, cap - len(TRUNCATION_MARKER))
+    return raw[:keep].decode("utf-8", errors="ignore") + TRUNCATION_MARKER
+
+def compact_tool_result(data: Any, limits: Optional[Dict] = None,
+                        measure: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """
+    Serialize a tool's data for the model within its limits:
+        { "fields": [...], "max_rows": 20, "rank_by": "score", "max_bytes": 8000, "max_tokens": 2000 }
+    Returns (text, stats) where stats has bytes/rows before and after.
+    bytes_before needs the whole original payload encoded: only done with measure=True
+    (e.g. when debug logging is on), otherwise it is None for list / projected results.
+    """
+    limits = limits or {}
+    cap = byte_cap(limits)
+    stats = {"bytes_before": None, "rows_before": None, "rows_after": None}
+    if measure:
+        stats["bytes_before"] = encoded_size(data)
+
+    if isinstance(data, list):
+        stats["rows_before"] = len(data)
+        rows = select_top_rows(data, limits.get("max_rows"), limits.get("rank_by"))
+        rows = project_rows(rows, limits.get("fields"))
+        text = encode_compact(rows)
+        if len(text.encode("utf-8")) > cap:
+            rows, text = fit_rows(rows, cap)
+        stats["rows_after"] = len(rows)
+    elif isinstance(data, dict) and limits.get("fields"):
+        text = truncate_text(encode_compact(project_rows([data], limits["fields"])[0]), cap)
+    else:
+        original = encode_compact(data)
+        stats["bytes_before"] = len(original.encode("utf-8"))
+        text = truncate_text(original, cap)
+
+    stats["bytes_after"] = len(text.encode("utf-8"))
+    return text, stats
+
+def describe_compaction(stats: Dict[str, Any]) -> str:
+    """Short human-readable summary for logs"""
+    before = f"{stats['bytes_before']:,}B" if stats["bytes_before"] is not None else "?"
+    summary = f"{before} -> {stats['bytes_after']:,}B"
+    if stats["rows_before"] is not None:
+        summary += f" (rows {stats['rows_before']} -> {stats['rows_after']})"
+    return summary
@@ -0,0 +1,165 @@
+"""
+usage_tracker.py
+Token usage and prompt-cache accounting for every model call.
+Reads response.usage (Responses API: input/output tokens, cached input tokens; Chat Completions:
+prompt/completion tokens) and aggregates it in memory per chat_id, per stage (main, tool
+follow-up, reset, embedding) and per model, together with upstream latency. Reports tokens/sec and
+cache-hit ratio, and exports per-call rows that line up with the timeline log.
+Per-chat totals are kept for the MAX_TRACKED_CHATS most recently active chats; older ones are
+folded into one "evicted" aggregate so overall totals stay exact.
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Any
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+STAGE_MAIN = "main"      # The user's turn
+STAGE_TOOL = "tool"      # Follow-up call that turns a tool result into the reply
+STAGE_RESET = "reset"    # New session seeded with recent / recalled history
+STAGE_EMBEDDING = "embedding"  # Long-term memory embeddings (see memory_index.py)
+
+MAX_CALL_ROWS = 100_000  # Most recent per-call rows kept for export
+MAX_TRACKED_CHATS = int(os.getenv("USAGE_MAX_TRACKED_CHATS", "100000"))  # Per-chat totals kept (LRU)
+
+COUNTERS = ("requests", "input_tokens", "cached_tokens", "output_tokens", "latency_seconds")
+
+def read_usage(response: Any) -> Dict[str, int]:
+    """Token counts from a Responses API or Chat Completions response (zeros if missing)"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+    input_tokens = getattr(usage, "input_tokens", None)
+    if input_tokens is not None:
+        details = getattr(usage, "input_tokens_details", None)
+        output_tokens = getattr(usage, "output_tokens", 0)
+    else:  # Chat Completions naming
+        input_tokens = getattr(usage, "prompt_tokens", 0)
+        details = getattr(usage, "prompt_tokens_details", None)
+        output_tokens = getattr(usage, "completion_tokens", 0)
+
+    return {
+        "input_tokens": input_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+        "output_tokens": output_tokens or 0,
+    }
+
+def new_totals() -> Dict[str, float]:
+    return dict.fromkeys(COUNTERS, 0)
+
+def derived_metrics(totals: Dict[str, float]) -> Dict[str, float]:
+    """Cache-hit ratio and throughput for one aggregate"""
+    latency = totals["latency_seconds"]
+    return {
+        **totals,
+        "latency_seconds": round(latency, 3),
+        "cache_hit_ratio": round(totals["cached_tokens"] / totals["input_tokens"], 3) if totals["input_tokens"] else 0.0,
+        "input_tokens_per_request": round(totals["input_tokens"] / totals["requests"], 1) if totals["requests"] else 0.0,
+        "tokens_per_second": round((totals["input_tokens"] + totals["output_tokens"]) / latency, 1) if latency else 0.0,
+        "output_tokens_per_second": round(totals["output_tokens"] / latency, 1) if latency else 0.0,
+        "mean_latency": round(latency / totals["requests"], 3) if totals["requests"] else 0.0,
+    }
+
+# ============================================================================
+# SECTION 2: TRACKER
+# ============================================================================
+
+class UsageTracker:
+    def __init__(self, max_rows: int = MAX_CALL_ROWS, max_chats: int = MAX_TRACKED_CHATS):
+        self.max_chats = max_chats
+        self.totals = new_totals()
+        self.by_chat: "OrderedDict[str, Dict[str, float]]" = OrderedDict()  # Least recently active first
+        self.evicted = new_totals()   # Sum of the chats dropped from by_chat
+        self.evictions = 0  # A chat dropped, re-added and dropped again counts twice
+        self.by_stage: Dict[str, Dict[str, float]] = {}
+        self.by_model: Dict[str, Dict[str, float]] = {}
+        self.calls: deque = deque(maxlen=max_rows)
+
+    def record(self, response: Any, chat_id: str, stage: str = STAGE_MAIN,
+               model: Optional[str] = None, latency: float = 0.0,
+               correlation_id: Optional[str] = None) -> Dict[str, Any]:
+        """Account one model call; returns its row (also kept for export)"""
+        usage = read_usage(response)
+        model = model or getattr(response, "model", None) or "unknown"
+        values = {"requests": 1, **usage, "latency_seconds": latency}
+
+        for table, key in ((self.by_chat, chat_id), (self.by_stage, stage), (self.by_model, model)):
+            totals = table.get(key)
+            if totals is None:
+                totals = table[key] = new_totals()
+            for name, value in values.items():
+                totals[name] += value
+        for name, value in values.items():
+            self.totals[name] += value
+        self._touch_chat(chat_id)
+
+        row = {
+            "time": time.time(),
+            "chat_id": chat_id,
+            "correlation_id": correlation_id,
+            "stage": stage,
+            "model": model,
+            "response_id": getattr(response, "id", None),
+            **usage,
+            "latency_seconds": round(latency, 4),
+        }
+        self.calls.append(row)
+        return row
+
+    def _touch_chat(self, chat_id: str):
+        """Mark chat_id most recently active; fold the least recent chats over max_chats into evicted"""
+        self.by_chat.move_to_end(chat_id)
+        while len(self.by_chat) > self.max_chats:
+            _, totals = self.by_chat.popitem(last=False)
+            for name, value in totals.items():
+                self.evicted[name] += value
+            self.evictions += 1
+
+    # ---- Reports ----
+
+    def report(self, top_chats: int = 5) -> Dict[str, Any]:
+        heaviest = sorted(self.by_chat.items(), key=lambda item: item[1]["input_tokens"], reverse=True)
+        return {
+            "totals": derived_metrics(self.totals),
+            "by_stage": {stage: derived_metrics(totals) for stage, totals in self.by_stage.items()},
+            "by_model": {model: derived_metrics(totals) for model, totals in self.by_model.items()},
+            "top_chats": {chat_id: derived_metrics(totals) for chat_id, totals in heaviest[:top_chats]},
+            "chats": len(self.by_chat),
+            "evictions": self.evictions,
+            "evicted": derived_metrics(self.evicted),
+        }
+
+    def chat_report(self, chat_id: str) -> Optional[Dict[str, float]]:
+        totals = self.by_chat.get(chat_id)
+        return derived_metrics(totals) if totals else None
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Per-call rows (same time / chat / correlation columns as the timeline log)"""
+        return list(self.calls)
+
+    def export_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"report": self.report(top_chats=len(self.by_chat)), "calls": self.rows()}, f, indent=2)
+
+    def print_report(self):
+        report = self.report()
+        totals = report["totals"]
+        evicted = f", {report['evictions']} evictions" if report["evictions"] else ""
+        print(f"\n🧮 TOKEN USAGE ({totals['requests']} calls, {report['chats']} chats{evicted})")
+        print(f"   Input {totals['input_tokens']} (cached {totals['cached_tokens']}, "
+              f"hit ratio {totals['cache_hit_ratio']:.0%}) | Output {totals['output_tokens']} | "
+              f"{totals['tokens_per_second']} tok/s")
+        for label, table in (("Stage", report["by_stage"]), ("Model", report["by_model"])):
+            for key, metrics in table.items():
+                print(f"   {label} {key:<14} {metrics['requests']:>6} calls | "
+                      f"{metrics['input_tokens_per_request']:>8} in/call | cache {metrics['cache_hit_ratio']:.0%} | "
+                      f"{metrics['mean_latency']}s mean | {metrics['output_tokens_per_second']} out tok/s")
+
+    def reset(self):
+        self.__init__(self.calls.maxlen, self.max_chats)